@@ -7,6 +7,8 @@ import gettext
 import functools
 import logging
 import time
+import json
+import threading
 from setproctitle import setproctitle
 import signal
 
@@ -29,15 +31,150 @@ STATUS_UNKNOWN = 0
 STATUS_NO_CALENDARS = 1
 STATUS_HAS_CALENDARS = 2
 
+# Events of each calendar source, per time range, kept across runs of the
+# server so the applet gets an answer before EDS has been queried again.
+CACHE_DIR = os.path.join(GLib.get_user_cache_dir(), "cinnamon", "calendar-server")
+CACHE_VERSION = 1
+CACHE_MAX_RANGES = 6
+CACHE_SAVE_DELAY_SECONDS = 2
+
+# Recurrence instances are sent in batches rather than one signal each: a batch
+# goes out when it is full, or once no more instances arrived for a moment.
+EVENT_BATCH_MAX_SIZE = 200
+EVENT_BATCH_FLUSH_MS = 50
+
+class EventCache:
+    """
+    The events of one calendar source, grouped by time range and then by the
+    component (uid + recurrence id) they were computed from, along with the
+    component's modification time.
+
+    When a view reports a component whose modification time matches the
+    cached one, its events are already known to the applet, so nothing has
+    to be computed or sent again.
+    """
+    def __init__(self, source_uid, zone):
+        self.source_uid = source_uid
+        self.path = os.path.join(CACHE_DIR, "%s.json" % source_uid)
+        self.zone = zone
+        self.ranges = {}
+        # The ranges of running views, which are never evicted.
+        self.pinned = set()
+        # Recurrence instances are added to the cached events outside of the
+        # main thread.
+        self.lock = threading.Lock()
+        self.save_id = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print("Could not read calendar cache %s: %s" % (self.path, e))
+            return
+
+        # Event times are localized, they're useless in another timezone.
+        if data.get("version") != CACHE_VERSION or data.get("zone") != self.zone:
+            return
+
+        self.ranges = data.get("ranges", {})
+
+    def save(self):
+        if self.save_id > 0:
+            GLib.source_remove(self.save_id)
+            self.save_id = 0
+
+        data = {
+            "version": CACHE_VERSION,
+            "zone": self.zone,
+            # Partially loaded ranges would hide events on the next run.
+            "ranges": {key: r for key, r in self.ranges.items() if r["complete"]}
+        }
+
+        with self.lock:
+            raw_data = json.dumps(data)
+
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(raw_data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Could not save calendar cache %s: %s" % (self.path, e))
+
+    def queue_save(self):
+        if self.save_id == 0:
+            self.save_id = GLib.timeout_add_seconds(CACHE_SAVE_DELAY_SECONDS, self.on_save_timeout)
+
+    def on_save_timeout(self):
+        self.save_id = 0
+        self.save()
+        return GLib.SOURCE_REMOVE
+
+    def delete(self):
+        if self.save_id > 0:
+            GLib.source_remove(self.save_id)
+            self.save_id = 0
+
+        self.ranges = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def clear(self):
+        self.ranges = {}
+        self.queue_save()
+
+    def pin(self, since, until):
+        self.pinned.add("%d:%d" % (since, until))
+
+    def unpin(self, since, until):
+        self.pinned.discard("%d:%d" % (since, until))
+
+    def get_range(self, since, until, create=False):
+        key = "%d:%d" % (since, until)
+        time_range = self.ranges.get(key)
+
+        if time_range is None and create:
+            time_range = { "used": 0, "complete": False, "objects": {} }
+            self.ranges[key] = time_range
+
+            unpinned = [k for k in self.ranges if k not in self.pinned and k != key]
+            if len(self.ranges) > CACHE_MAX_RANGES and len(unpinned) > 0:
+                oldest = min(unpinned, key=lambda k: self.ranges[k]["used"])
+                del self.ranges[oldest]
+
+        if time_range is not None:
+            time_range["used"] = int(time.time())
+
+        return time_range
+
+    def get_events(self, since, until):
+        time_range = self.get_range(since, until)
+        if time_range is None or not time_range["complete"]:
+            return []
+
+        events = []
+        for entry in time_range["objects"].values():
+            events.extend(entry["events"])
+
+        return events
+
 class CalendarInfo(GObject.Object):
     __gsignals__ = {
         "color-changed": (GObject.SignalFlags.RUN_LAST, None, ()),
     }
-    def __init__(self, source, client):
+    def __init__(self, source, client, cache):
         super(CalendarInfo, self).__init__()
         # print(source, client)
         self.source = source
         self.client = client
+        self.cache = cache
 
         self.syncing = False
 
@@ -53,11 +190,8 @@ class CalendarInfo(GObject.Object):
             self.refresh.set_interval_minutes(1)
             self.source.refresh_add_timeout(None, self.on_refresh_timeout)
 
-        self.start = None
-        self.end = None
-
-        self.view = None
-        self.view_cancellable = None
+        # (since, until) -> CalendarView
+        self.views = {}
         self.events = []
 
     def try_sync(self):
@@ -84,21 +218,57 @@ class CalendarInfo(GObject.Object):
 
         self.disconnect(self.owner_color_signal_id)
 
-        if self.view_cancellable is not None:
-            self.view_cancellable.cancel()
-
-        if self.view is not None:
-            self.view.stop()
-        self.view = None
+        for view in self.views.values():
+            view.stop()
+        self.views = {}
 
     def ext_color_prop_changed(self, extension, pspect, data=None):
         self.color = self.extension.get_color()
         self.emit("color-changed")
 
+class CalendarView:
+    """
+    An EDS view of one calendar over one time range.
+
+    Only the active view's events are sent to the applet. The views of the
+    neighbouring ranges are kept running to keep their part of the cache
+    current, so paging through months doesn't need a new query.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+        self.view = None
+        self.cancellable = Gio.Cancellable()
+        self.active = False
+        self.complete = False
+
+        # The cached objects of the range, and which of them the view has
+        # reported so far.
+        self.cached_objects = {}
+        self.seen_objects = set()
+
+        # Generated instances waiting to be sent. Instances can be generated
+        # outside of the main thread, hence the lock.
+        self.batch_lock = threading.Lock()
+        self.batch = None
+        self.batch_size = 0
+        self.batch_flush_id = 0
+
+    def stop(self):
+        self.cancellable.cancel()
+
+        if self.view is not None:
+            self.view.stop()
+        self.view = None
+
 class Event:
     def __init__(self, uid, color, summary, all_day, start_timet, end_timet, mod_timet):
         self.__dict__.update(locals())
 
+    def to_list(self):
+        return [self.uid, self.color, self.summary, self.all_day, self.start_timet, self.end_timet, self.mod_timet]
+
 class CalendarServer(Gio.Application):
     def __init__(self, hold=False):
         Gio.Application.__init__(self,
@@ -116,6 +286,10 @@ class CalendarServer(Gio.Application):
         self.client_disappeared_id = 0
 
         self.calendars = {}
+        self.caches = {}
+
+        # The sources whose cached events were sent for the current range.
+        self.replayed_sources = set()
 
         self.current_month_start = 0
         self.current_month_end = 0
@@ -183,6 +357,11 @@ class CalendarServer(Gio.Application):
     def source_appeared(self, watcher, source):
         print("Discovered calendar: ", source.get_display_name())
 
+        # Answer from the cache while the client connects.
+        cache = self.get_cache(source.get_uid())
+        if self.current_month_start != 0 and self.current_month_end != 0:
+            self.emit_cached_events(cache)
+
         self.hold()
         ECal.Client.connect(source, ECal.ClientSourceType.EVENTS, 10, None, self.ecal_client_connected, source)
 
@@ -194,21 +373,23 @@ class CalendarServer(Gio.Application):
             client = ECal.Client.connect_finish(res)
             client.set_default_timezone(self.zone)
 
-            calendar = CalendarInfo(source, client)
+            calendar = CalendarInfo(source, client, self.get_cache(source.get_uid()))
             calendar.owner_color_signal_id = calendar.connect("color-changed", self.source_color_changed)
             self.calendars[source.get_uid()] = calendar
 
             self.update_status()
 
             if self.current_month_start != 0 and self.current_month_end != 0:
-                self.create_view_for_calendar(calendar)
+                self.update_views_for_calendar(calendar)
         except GLib.Error as e:
             # what to do
             print("couldn't connect to source", e.message)
             return
 
     def source_color_changed(self, calendar):
-        self.create_view_for_calendar(calendar)
+        # The cached events all carry the old color.
+        calendar.cache.clear()
+        self.update_views_for_calendar(calendar, reload=True)
 
     def source_disappeared(self, watcher, source):
         try:
@@ -217,10 +398,15 @@ class CalendarServer(Gio.Application):
             # We had a source but it wasn't for a calendar.
             return
 
+        for view in calendar.views.values():
+            self.drop_queued_events(view)
         self.interface.emit_client_disappeared(source.get_uid())
         calendar.destroy()
+        calendar.cache.delete()
 
         del self.calendars[source.get_uid()]
+        del self.caches[source.get_uid()]
+        self.replayed_sources.discard(source.get_uid())
 
         self.update_status()
 
@@ -257,77 +443,197 @@ class CalendarServer(Gio.Application):
         for calendar in self.calendars.values():
             calendar.try_sync()
 
+        if time_since != self.current_month_start or time_until != self.current_month_end:
+            # The applet drops the events of the month it moves away from.
+            self.replayed_sources = set()
+
         self.current_month_start = time_since
         self.current_month_end = time_until
 
         self.interface.set_property("since", time_since)
         self.interface.set_property("until", time_until)
 
+        for cache in self.caches.values():
+            self.emit_cached_events(cache)
+
         for uid in self.calendars.keys():
             calendar = self.calendars[uid]
-            self.create_view_for_calendar(calendar)
+            self.update_views_for_calendar(calendar, reload=force_reload)
 
         self.interface.complete_set_time_range(inv)
         return True
 
+    def get_cache(self, source_uid):
+        try:
+            return self.caches[source_uid]
+        except KeyError:
+            cache = EventCache(source_uid, self.zone.get_location())
+            self.caches[source_uid] = cache
+            return cache
+
+    def emit_cached_events(self, cache):
+        # The applet keeps what it was sent, even when the range is reloaded.
+        if cache.source_uid in self.replayed_sources:
+            return
+
+        self.replayed_sources.add(cache.source_uid)
+
+        events = cache.get_events(self.current_month_start, self.current_month_end)
+        if len(events) > 0:
+            self.interface.emit_events_added_or_updated(GLib.Variant("a(sssbxxx)", events))
+
     def handle_exit(self, iface, inv):
         self.exit()
         self.interface.complete_exit(inv)
 
-    def create_view_for_calendar(self, calendar):
-        self.hold()
+    def get_month_range(self, month_start):
+        # The same grid the applet asks for (see fetch_month_events() in
+        # eventView.js): 42 days from the start of the week of the 1st.
+        week_day = month_start.get_day_of_week()
+        start = month_start.add_days(-(week_day - Cinnamon.util_get_week_start()))
+        end = start.add_days(42).add_seconds(-1)
+
+        return (start.to_unix(), end.to_unix())
+
+    def get_window_ranges(self):
+        # The current range, then the months before and after it.
+        current = (self.current_month_start, self.current_month_end)
+
+        middle = GLib.DateTime.new_from_unix_local(current[0] + (current[1] - current[0]) // 2)
+        month = GLib.DateTime.new_local(middle.get_year(), middle.get_month(), 1, 0, 0, 0)
+
+        ranges = [current]
+        for adjacent in (self.get_month_range(month.add_months(-1)), self.get_month_range(month.add_months(1))):
+            if adjacent not in ranges:
+                ranges.append(adjacent)
+
+        return ranges
+
+    def update_views_for_calendar(self, calendar, reload=False):
+        window = self.get_window_ranges()
+        current = window[0]
+
+        for key in list(calendar.views.keys()):
+            if reload or key not in window:
+                self.stop_view(calendar, calendar.views.pop(key))
+            elif key != current and calendar.views[key].active:
+                # The applet drops the events of the month it moves away from.
+                calendar.views[key].active = False
+                self.drop_queued_events(calendar.views[key])
+
+        view = calendar.views.get(current)
+        if view is None:
+            view = self.create_view_for_calendar(calendar, *current)
+            view.active = True
+            return
 
-        if calendar.view_cancellable is not None:
-            calendar.view_cancellable.cancel()
-        calendar.view_cancellable = Gio.Cancellable()
+        view.active = True
+        if not view.complete:
+            # Only complete ranges were sent from the cache, catch the applet
+            # up with what this one has found so far.
+            events = [event for entry in view.cached_objects.values() for event in entry["events"]]
+            if len(events) > 0:
+                self.interface.emit_events_added_or_updated(GLib.Variant("a(sssbxxx)", events))
+        else:
+            self.prefetch_adjacent_ranges(calendar)
 
-        if calendar.view is not None:
-            calendar.view.stop()
-        calendar.view = None
+    def prefetch_adjacent_ranges(self, calendar):
+        for key in self.get_window_ranges()[1:]:
+            if key not in calendar.views:
+                self.create_view_for_calendar(calendar, *key)
 
-        from_iso = ECal.isodate_from_time_t(self.current_month_start)
-        to_iso = ECal.isodate_from_time_t(self.current_month_end)
+    def stop_view(self, calendar, view):
+        self.drop_queued_events(view)
+        view.stop()
+        calendar.cache.unpin(view.start, view.end)
 
-        calendar.start = self.current_month_start
-        calendar.end = self.current_month_end
+    def create_view_for_calendar(self, calendar, start, end):
+        self.hold()
+
+        view = CalendarView(start, end)
+        calendar.views[(start, end)] = view
+
+        from_iso = ECal.isodate_from_time_t(start)
+        to_iso = ECal.isodate_from_time_t(end)
+
+        # The applet has been sent the events of a complete range already, the
+        # view only needs to report what changed since.
+        calendar.cache.pin(start, end)
+        time_range = calendar.cache.get_range(start, end, create=True)
+        if not time_range["complete"]:
+            time_range["objects"] = {}
+        view.cached_objects = time_range["objects"]
 
         query = "occur-in-time-range? (make-time \"%s\") (make-time \"%s\") \"%s\"" %\
                  (from_iso, to_iso, self.zone.get_location())
 
-        calendar.client.get_view(query, calendar.view_cancellable, self.got_calendar_view, calendar)
+        calendar.client.get_view(query, view.cancellable, self.got_calendar_view, (calendar, view))
+        return view
 
-    def got_calendar_view(self, client, res, calendar):
+    def got_calendar_view(self, client, res, data):
+        (calendar, view) = data
         self.release()
 
-        if calendar.view_cancellable.is_cancelled():
+        if view.cancellable.is_cancelled():
             return
 
         try:
-            success, view = client.get_view_finish(res)
-            calendar.view = view
+            success, client_view = client.get_view_finish(res)
+            view.view = client_view
         except GLib.Error as e:
             print("get view failed: ", e.message)
             return
 
-        view.set_flags(ECal.ClientViewFlags.NOTIFY_INITIAL)
-        view.connect("objects-added", self.view_objects_added, calendar)
-        view.connect("objects-modified", self.view_objects_modified, calendar)
-        view.connect("objects-removed", self.view_objects_removed, calendar)
-        view.start()
+        client_view.set_flags(ECal.ClientViewFlags.NOTIFY_INITIAL)
+        client_view.connect("objects-added", self.view_objects_added, data)
+        client_view.connect("objects-modified", self.view_objects_modified, data)
+        client_view.connect("objects-removed", self.view_objects_removed, data)
+        client_view.connect("complete", self.view_complete, data)
+        client_view.start()
 
-    def view_objects_added(self, view, objects, calendar):
-        self.handle_new_or_modified_objects(view, objects, calendar)
+    def view_objects_added(self, client_view, objects, data):
+        self.handle_new_or_modified_objects(objects, *data)
 
-    def view_objects_modified(self, view, objects, calendar):
-        self.handle_new_or_modified_objects(view, objects, calendar)
+    def view_objects_modified(self, client_view, objects, data):
+        self.handle_new_or_modified_objects(objects, *data)
 
-    def view_objects_removed(self, view, component_ids, calendar):
+    def view_objects_removed(self, client_view, component_ids, data):
         print("objects removed: ", component_ids)
 
-        self.handle_removed_objects(view, component_ids, calendar)
+        self.handle_removed_objects(component_ids, *data)
+
+    def view_complete(self, client_view, error, data):
+        (calendar, view) = data
+        if view.cancellable.is_cancelled():
+            return
 
-    def handle_new_or_modified_objects(self, view, objects, calendar):
-        if calendar.view_cancellable.is_cancelled():
+        if error is not None:
+            print("view failed to complete: ", error.message)
+            return
+
+        self.flush_queued_events(view)
+
+        # Anything cached that the view didn't report is gone from the calendar.
+        removed = [key for key in view.cached_objects if key not in view.seen_objects]
+        uids = []
+        for key in removed:
+            uids.extend(event[0] for event in view.cached_objects.pop(key)["events"])
+
+        if len(uids) > 0 and view.active:
+            self.interface.emit_events_removed("::".join(uids))
+
+        view.complete = True
+        time_range = calendar.cache.get_range(view.start, view.end)
+        if time_range is not None:
+            time_range["complete"] = True
+            calendar.cache.queue_save()
+
+        # Warm up the neighbouring months once the one on screen is done.
+        if view.active:
+            self.prefetch_adjacent_ranges(calendar)
+
+    def handle_new_or_modified_objects(self, objects, calendar, view):
+        if view.cancellable.is_cancelled():
             return
 
         self.hold()
@@ -339,18 +645,39 @@ class CalendarServer(Gio.Application):
             if ical_comp.get_uid() is None:
                 continue
 
+            comp = ECal.Component.new_from_icalcomponent(ical_comp)
+            key = self.create_uid(calendar, comp)
+            mod_timet = self.get_mod_timet(ical_comp)
+
+            view.seen_objects.add(key)
+            cached = view.cached_objects.get(key)
+            if cached is not None:
+                # Without a modification time there's no telling if it changed.
+                if mod_timet != 0 and cached["mod"] == mod_timet:
+                    continue
+
+                # Drop the old instances, the changes may have removed some.
+                old_uids = [event[0] for event in cached["events"] if event[0] != key]
+                if len(old_uids) > 0 and view.active:
+                    # Queued instances of the old version mustn't arrive after their removal.
+                    self.flush_queued_events(view)
+                    self.interface.emit_events_removed("::".join(old_uids))
+
+            entry = { "mod": mod_timet, "events": [] }
+            view.cached_objects[key] = entry
+            calendar.cache.queue_save()
+
             if (not ECal.util_component_is_instance (ical_comp)) and \
               ECal.util_component_has_recurrences(ical_comp):
                 calendar.client.generate_instances_for_object(
                     ical_comp,
-                    calendar.start,
-                    calendar.end,
-                    calendar.view_cancellable,
+                    view.start,
+                    view.end,
+                    view.cancellable,
                     self.recurrence_generated,
-                    calendar
+                    (calendar, view, entry)
                 )
             else:
-                comp = ECal.Component.new_from_icalcomponent(ical_comp)
                 comptext = comp.get_summary()
                 if comptext is not None:
                     summary = comptext.get_value()
@@ -370,10 +697,8 @@ class CalendarServer(Gio.Application):
                 else:
                     end_timet = start_timet + (60 * 30) # Default to 30m if the end time is bad.
 
-                mod_timet = self.get_mod_timet(ical_comp)
-
                 event = Event(
-                    self.create_uid(calendar, comp),
+                    key,
                     calendar.color,
                     summary,
                     all_day,
@@ -382,18 +707,19 @@ class CalendarServer(Gio.Application):
                     mod_timet
                 )
 
+                entry["events"].append(event.to_list())
                 events.append(event)
-        if len(events) > 0:
-            self.emit_events_added_or_updated(calendar, events)
+        if len(events) > 0 and view.active:
+            self.emit_events_added_or_updated(view, events)
 
         self.release()
 
-    def recurrence_generated(self, ical_comp, instance_start, instance_end, calendar, cancellable):
-        if calendar.view_cancellable.is_cancelled():
+    def recurrence_generated(self, ical_comp, instance_start, instance_end, data, cancellable):
+        (calendar, view, entry) = data
+        if view.cancellable.is_cancelled():
             return False
 
         comp = ECal.Component.new_from_icalcomponent(ical_comp)
-        all_objects = GLib.VariantBuilder(GLib.VariantType.new("a(sssbxx)"))
 
         comptext = comp.get_summary()
         if comptext is not None:
@@ -426,32 +752,84 @@ class CalendarServer(Gio.Application):
             mod_timet
         )
 
-        self.emit_events_added_or_updated(calendar, [event])
+        with calendar.cache.lock:
+            entry["events"].append(event.to_list())
+        if view.active:
+            self.queue_event(view, event)
 
         return True
 
-    def emit_events_added_or_updated(self, calendar, events):
+    def queue_event(self, view, event):
+        with view.batch_lock:
+            if view.batch is None:
+                view.batch = GLib.VariantBuilder(GLib.VariantType.new("a(sssbxxx)"))
+
+            if not self.add_event_to_builder(view, view.batch, event):
+                return
+
+            view.batch_size += 1
+            full = view.batch_size >= EVENT_BATCH_MAX_SIZE
+
+            if not full and view.batch_flush_id == 0:
+                view.batch_flush_id = GLib.timeout_add(EVENT_BATCH_FLUSH_MS, self.on_batch_flush_timeout, view)
+
+        if full:
+            self.flush_queued_events(view)
+
+    def on_batch_flush_timeout(self, view):
+        with view.batch_lock:
+            view.batch_flush_id = 0
+
+        self.flush_queued_events(view)
+        return GLib.SOURCE_REMOVE
+
+    def flush_queued_events(self, view):
+        with view.batch_lock:
+            batch = view.batch
+            size = view.batch_size
+            self.reset_batch(view)
+
+        if batch is not None and size > 0:
+            self.interface.emit_events_added_or_updated(batch.end())
+
+    def drop_queued_events(self, view):
+        with view.batch_lock:
+            self.reset_batch(view)
+
+    def reset_batch(self, view):
+        if view.batch_flush_id > 0:
+            GLib.source_remove(view.batch_flush_id)
+            view.batch_flush_id = 0
+
+        view.batch = None
+        view.batch_size = 0
+
+    def add_event_to_builder(self, view, builder, event):
+        if event.end_timet <= (view.start - 1) and event.start_timet >= view.end:
+            return False
+
+        event_var = GLib.Variant(
+            "(sssbxxx)",
+            [
+                event.uid,
+                event.color,
+                event.summary,
+                event.all_day,
+                event.start_timet,
+                event.end_timet,
+                event.mod_timet
+            ]
+        )
+
+        builder.add_value(event_var)
+        return True
+
+    def emit_events_added_or_updated(self, view, events):
         # print("package: ",len(events))
         all_events = GLib.VariantBuilder(GLib.VariantType.new("a(sssbxxx)"))
 
         for event in events:
-            if event.end_timet <= (calendar.start - 1) and event.start_timet >= calendar.end:
-                continue
-
-            event_var = GLib.Variant(
-                "(sssbxxx)",
-                [
-                    event.uid,
-                    event.color,
-                    event.summary,
-                    event.all_day,
-                    event.start_timet,
-                    event.end_timet,
-                    event.mod_timet
-                ]
-            )
-
-            all_events.add_value(event_var)
+            self.add_event_to_builder(view, all_events, event)
 
         self.interface.emit_events_added_or_updated(all_events.end())
 
@@ -499,20 +877,29 @@ class CalendarServer(Gio.Application):
         else:
             return "%s:%s" % (source_id, comp_id.get_uid())
 
-    def handle_removed_objects(self, view, component_ids, calendar):
+    def handle_removed_objects(self, component_ids, calendar, view):
         # what else?
         # print("handle: ", uuid_list)
         source_id = calendar.source.get_uid()
 
+        # Don't let queued instances of a removed event arrive after its removal.
+        self.flush_queued_events(view)
+
         uids = []
 
         for comp_id in component_ids:
             uid = self.get_id_from_comp_id(comp_id, source_id)
             uids.append(uid)
 
+            # a recurring event's instances have ids of their own
+            cached = view.cached_objects.pop(uid, None)
+            if cached is not None:
+                uids.extend(event[0] for event in cached["events"] if event[0] != uid)
+                calendar.cache.queue_save()
+
         uids_string = "::".join(uids)
 
-        if uids_string != "":
+        if uids_string != "" and view.active:
             self.interface.emit_events_removed(uids_string)
 
     def exit(self):
@@ -521,8 +908,13 @@ class CalendarServer(Gio.Application):
             self.registry_watcher.disconnect(self.client_disappeared_id)
 
         for uid in self.calendars.keys():
+            for view in self.calendars[uid].views.values():
+                self.flush_queued_events(view)
             self.calendars[uid].destroy()
 
+        for cache in self.caches.values():
+            cache.save()
+
         GLib.idle_add(self.quit)
 
 def main():
@@ -13,6 +13,7 @@
 #   - auto-completion ?
 
 import os
+import codecs
 import signal
 import sys
 import gi
@@ -41,6 +42,12 @@ melange_xml = """
 """
 interface_node_info = Gio.DBusNodeInfo.new_for_xml(melange_xml)
 
+# File watcher tabs follow the end of the file: only the last lines are shown,
+# and when more than FILE_WATCHER_MAX_READ bytes were added at once (or on
+# opening a big file) everything before that is skipped.
+FILE_WATCHER_MAX_LINES = 10000
+FILE_WATCHER_MAX_READ = 4 * 1024 * 1024
+
 class MenuButton(Gtk.Button):
     def __init__(self, text):
         Gtk.Button.__init__(self, text)
@@ -229,6 +236,11 @@ class FileWatcherView(Gtk.ScrolledWindow):
 
         self.filename = filename
         self.update_id = 0
+        # Where the next read starts, in which file (by device and inode,
+        # to notice log rotation).
+        self.offset = 0
+        self.file_id = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         self.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
         self.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
 
@@ -266,21 +278,61 @@ class FileWatcherView(Gtk.ScrolledWindow):
 
     def get_updates(self):
         # only update 2 times per second max - a single write produces a
-        # changed/changes-done-hint pair, and update() re-reads the whole file
+        # changed/changes-done-hint pair
         if self.update_id == 0:
             self.update_id = GLib.timeout_add(500, self.update)
 
+    def reset(self, file_id):
+        self.offset = 0
+        self.file_id = file_id
+        self.decoder.reset()
+        self.textbuffer.set_text("")
+
     def update(self):
         self.update_id = 0
 
+        skipped = False
         try:
-            with open(self.filename, 'r') as f:
-                self.textbuffer.set_text(f.read())
+            with open(self.filename, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                file_id = (stat.st_dev, stat.st_ino)
+
+                # A new file (rotated) or a truncated one is read from the start.
+                if file_id != self.file_id or stat.st_size < self.offset:
+                    self.reset(file_id)
+
+                if stat.st_size - self.offset > FILE_WATCHER_MAX_READ:
+                    self.offset = stat.st_size - FILE_WATCHER_MAX_READ
+                    skipped = True
+
+                f.seek(self.offset)
+                data = f.read(stat.st_size - self.offset)
         except OSError as e:
+            self.reset(None)
             self.textbuffer.set_text("Could not read %s: %s" % (self.filename, e))
+            return False
+
+        self.offset += len(data)
+
+        if skipped:
+            # what's shown is no longer followed by what gets added, and the
+            # read may start halfway through a line
+            self.textbuffer.set_text("")
+            self.decoder.reset()
+            data = data[data.find(b"\n") + 1:]
+
+        text = self.decoder.decode(data)
+        if text:
+            self.textbuffer.insert(self.textbuffer.get_end_iter(), text)
+            self.trim()
 
         return False
 
+    def trim(self):
+        excess = self.textbuffer.get_line_count() - FILE_WATCHER_MAX_LINES
+        if excess > 0:
+            self.textbuffer.delete(self.textbuffer.get_start_iter(), self.textbuffer.get_iter_at_line(excess))
+
 class ClosableTabLabel(Gtk.Box):
     __gsignals__ = {
         "close-clicked": (GObject.SignalFlags.RUN_FIRST, GObject.TYPE_NONE, ()),
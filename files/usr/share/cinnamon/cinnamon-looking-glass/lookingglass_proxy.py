@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-from gi.repository import Gio, GObject
+from gi.repository import Gio, GLib, GObject
 
 LG_DBUS_NAME = "org.Cinnamon.LookingGlass"
 LG_DBUS_PATH = "/org/Cinnamon/LookingGlass"
@@ -15,6 +15,8 @@ class LookingGlassProxy(GObject.Object):
         GObject.Object.__init__(self)
         self._proxy = None
         self.state = False
+        # False once the running Cinnamon turns out to predate GetErrorStackSince
+        self.has_error_stack_since = True
         Gio.bus_watch_name(Gio.BusType.SESSION,
                            LG_DBUS_NAME,
                            Gio.BusNameWatcherFlags.NONE,
@@ -51,6 +53,7 @@ class LookingGlassProxy(GObject.Object):
 
     def on_bus_disconnect(self, connection, name):
         self._proxy = None
+        self.has_error_stack_since = True
         self.refresh_status()
 
     def init_proxy(self):
@@ -106,6 +109,53 @@ class LookingGlassProxy(GObject.Object):
     def _get_error_stack_error_cb(self, proxy, error):
         print("Couldn't fetch the error stack: %s" % error.message)
 
+    def GetErrorStackSince(self, log_id, cursor, result_cb):
+        """Fetch the log entries added since cursor. result_cb gets
+        [success, log_id, cursor, entries]. Returns False if no request
+        could be made."""
+        if not self._proxy:
+            return False
+
+        if not self.has_error_stack_since:
+            return self._get_error_stack_since_fallback(log_id, cursor, result_cb)
+
+        try:
+            self._proxy.GetErrorStackSince('(su)', log_id, cursor,
+                                           result_handler=result_cb,
+                                           error_handler=self._get_error_stack_since_error_cb,
+                                           user_data=(log_id, cursor, result_cb))
+        except Exception:
+            return False
+        return True
+
+    def _get_error_stack_since_error_cb(self, proxy, error, user_data):
+        (log_id, cursor, result_cb) = user_data
+        if error.matches(Gio.dbus_error_quark(), Gio.DBusError.UNKNOWN_METHOD):
+            self.has_error_stack_since = False
+            if self._get_error_stack_since_fallback(log_id, cursor, result_cb):
+                return
+        else:
+            print("Couldn't fetch the error stack: %s" % error.message)
+
+        result_cb(proxy, [False, log_id, cursor, []], user_data)
+
+    def _get_error_stack_since_fallback(self, log_id, cursor, result_cb):
+        # An older Cinnamon only hands out the whole log, page through it here.
+        def on_result(proxy, result, user_data=None):
+            [success, data] = result
+            start = cursor if cursor <= len(data) else 0
+            result_cb(proxy, [success, log_id, len(data), data[start:]], user_data)
+
+        def on_error(proxy, error, user_data=None):
+            self._get_error_stack_error_cb(proxy, error)
+            result_cb(proxy, [False, log_id, cursor, []], user_data)
+
+        try:
+            self._proxy.GetErrorStack('()', result_handler=on_result, error_handler=on_error)
+        except Exception:
+            return False
+        return True
+
     def GetMemoryInfo(self):
         if self._proxy:
             try:
@@ -1,9 +1,13 @@
 #!/usr/bin/python3
 
 import datetime
+from collections import deque
 from gi.repository import Gtk, Pango
 import pageutils
 
+# Only the most recent entries are kept, in the view as well as in memory.
+LOG_MAX_ENTRIES = 5000
+
 class LogEntry:
     def __init__(self, category, time, message):
         self.category = category
@@ -11,6 +15,7 @@ class LogEntry:
         self.timestr = datetime.datetime.fromtimestamp(self.time).strftime("%Y-%m-%dT%H:%M:%SZ")
         self.message = message
         self.formatted_text = "%s t=%s %s\n" % (category, self.timestr, message)
+        self.lines = self.formatted_text.count("\n")
 
 class LogView(Gtk.ScrolledWindow):
     def __init__(self, proxy):
@@ -28,10 +33,14 @@ class LogView(Gtk.ScrolledWindow):
         self.textbuffer = self.textview.get_buffer()
         self.scroll_mark = self.textbuffer.create_mark(None, self.textbuffer.get_end_iter(), False)
 
-        self.log = []
-        self.added_messages = 0
-        self.first_message_time = None
+        self.log = deque()
+        # Position in Cinnamon's log, see LookingGlassProxy.GetErrorStackSince()
+        self.log_id = ""
+        self.cursor = 0
         self.need_reread = False
+        self.fetching = False
+        self.fetch_pending = False
+        self.reread_requested = False
 
         context = self.get_style_context()
 
@@ -66,6 +75,21 @@ class LogView(Gtk.ScrolledWindow):
         self.log.append(entry)
         return entry
 
+    def clear(self):
+        self.log.clear()
+        start, end = self.textbuffer.get_bounds()
+        self.textbuffer.delete(start, end)
+
+    def trim(self):
+        lines = 0
+        while len(self.log) > LOG_MAX_ENTRIES:
+            lines += self.log.popleft().lines
+
+        if lines > 0:
+            start = self.textbuffer.get_start_iter()
+            end = self.textbuffer.get_iter_at_line(lines)
+            self.textbuffer.delete(start, end)
+
     def on_button_toggled(self, button, data):
         active = button.get_active()
         self.enabled_types[data] = active
@@ -90,42 +114,63 @@ class LogView(Gtk.ScrolledWindow):
         self.get_updates()
 
     def get_updates(self, proxy=None):
-        self.proxy.GetErrorStack(result_cb=self.get_error_stack_finished)
+        # One request at a time, log updates coming in meanwhile are picked
+        # up by a single follow-up request.
+        if self.fetching:
+            self.fetch_pending = True
+            return
+
+        self.reread_requested = self.need_reread
+        cursor = 0 if self.need_reread else self.cursor
+        self.fetching = self.proxy.GetErrorStackSince(self.log_id, cursor, self.get_error_stack_finished)
 
     def get_error_stack_finished(self, proxy, result, user_data=None):
-        [success, data] = result
+        [success, log_id, cursor, data] = result
+        self.fetching = False
 
-        if success:
+        if success and self.need_reread and not self.reread_requested:
+            # answers a request made before the reread was asked for
+            self.fetch_pending = True
+        elif success:
             try:
-                data_size = len(data)
-                if data_size > 0:
-                    # If this is a completely new log, start reading at the beginning
-                    first_message_time = data[0]["timestamp"]
-                    if (self.added_messages > data_size or
-                            self.first_message_time != first_message_time or
-                            self.need_reread):
-                        self.first_message_time = first_message_time
-                        self.added_messages = 0
-
-                    if self.need_reread:
-                        start, end = self.textbuffer.get_bounds()
-                        self.textbuffer.delete(start, end)
-
+                # If this is a completely new log, start reading at the beginning
+                if self.reread_requested or log_id != self.log_id:
+                    self.clear()
                     self.need_reread = False
 
-                    text_iter = self.textbuffer.get_end_iter()
-                    for item in data[self.added_messages:]:
-                        entry = self.append(item["category"],
-                                            float(item["timestamp"]) * 0.001,
-                                            item["message"])
-                        self.textbuffer.insert_with_tags(text_iter,
-                                                         entry.formatted_text,
-                                                         self.type_tags[entry.category])
-                        self.added_messages += 1
-                    self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
+                self.log_id = log_id
+                self.cursor = cursor
+                self.add_entries(data[-LOG_MAX_ENTRIES:])
             except Exception as exc:
                 print(exc)
 
+        if self.fetch_pending:
+            self.fetch_pending = False
+            self.get_updates()
+
+    def add_entries(self, data):
+        if len(data) == 0:
+            return
+
+        # Consecutive entries of the same category go in with a single insert.
+        text_iter = self.textbuffer.get_end_iter()
+        run = []
+        run_category = None
+        for item in data:
+            entry = self.append(item["category"],
+                                float(item["timestamp"]) * 0.001,
+                                item["message"])
+            if entry.category != run_category and len(run) > 0:
+                self.textbuffer.insert_with_tags(text_iter, "".join(run), self.type_tags[run_category])
+                run = []
+            run_category = entry.category
+            run.append(entry.formatted_text)
+
+        self.textbuffer.insert_with_tags(text_iter, "".join(run), self.type_tags[run_category])
+
+        self.trim()
+        self.textview.scroll_to_mark(self.scroll_mark, 0, True, 1, 1)
+
 class ModulePage(pageutils.WindowAndActionBars):
     def __init__(self, parent):
         self.view = LogView(parent.lg_proxy)
@@ -8,8 +8,11 @@ from bin.SettingsWidgets import CAN_BACKEND as c_can_backend
 from bin.TreeListWidgets import List
 import os
 import collections
+import hashlib
 import json
 import operator
+import stat
+import tempfile
 
 can_backend = px_can_backend + c_can_backend
 can_backend.append('List')
@@ -41,6 +44,31 @@ OPERATIONS = ['<=', '>=', '<', '>', '!=', '=']
 
 OPERATIONS_MAP = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '!=': operator.ne, '=': operator.eq}
 
+# Changes made within this long of each other are written out together
+SAVE_DELAY_MS = 250
+
+# When the file changes on disk it is reloaded this long after the writer is done
+# with it, or after the last write if it doesn't say, but never more than
+# RELOAD_MAX_DELAY_MS after the first change.
+RELOAD_DELAY_MS = 50
+RELOAD_WRITING_DELAY_MS = 300
+RELOAD_MAX_DELAY_MS = 1000
+
+def get_file_identity(info):
+    return (info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+
+def get_changed_keys(old_settings, new_settings):
+    """Returns the keys of new_settings whose value is new or differs from
+    the one in old_settings."""
+    changed = []
+    for key, props in new_settings.items():
+        if not isinstance(props, dict) or "value" not in props:
+            continue
+        old_props = old_settings.get(key)
+        if not isinstance(old_props, dict) or "value" not in old_props or old_props["value"] != props["value"]:
+            changed.append(key)
+    return changed
+
 class JSONSettingsHandler(object):
     def __init__(self, filepath, uuid = None, instance_id = None, notify_callback=None):
         super(JSONSettingsHandler, self).__init__()
@@ -59,7 +87,15 @@ class JSONSettingsHandler(object):
 
         self.timeout_id = 0
         self.file_monitor_id = 0
-        self.settings = self.get_settings()
+        self.save_id = 0
+        self.changed_keys = []
+        self.changed_all = False
+        self.reload_deadline = 0
+
+        # what the file looked like when it was last read or written, so that
+        # change notifications that didn't change anything can be ignored
+        self.file_identity, self.file_hash, raw_data = self.read_settings_file()
+        self.settings = self.parse_settings(raw_data)
         self.resume_monitor()
 
     def pause_monitor(self):
@@ -73,10 +109,20 @@ class JSONSettingsHandler(object):
     def resume_monitor(self):
         self.file_monitor_id = self.file_monitor.connect("changed", self.on_file_changed)
 
-    def on_file_changed(self, *args):
+    def on_file_changed(self, monitor, file, other_file, event_type):
+        now = GLib.get_monotonic_time() // 1000
         if self.timeout_id > 0:
             GLib.source_remove(self.timeout_id)
-        self.timeout_id = GLib.timeout_add(2000, self.check_settings)
+        else:
+            self.reload_deadline = now + RELOAD_MAX_DELAY_MS
+
+        if event_type == Gio.FileMonitorEvent.CHANGED:
+            delay = RELOAD_WRITING_DELAY_MS
+        else:
+            delay = RELOAD_DELAY_MS
+
+        delay = max(0, min(delay, self.reload_deadline - now))
+        self.timeout_id = GLib.timeout_add(delay, self.check_settings)
 
     def bind(self, key, obj, prop, direction, map_get=None, map_set=None):
         if direction & (Gio.SettingsBindFlags.SET | Gio.SettingsBindFlags.GET) == 0:
@@ -101,11 +147,13 @@ class JSONSettingsHandler(object):
         return self.get_property(key, "value")
 
     def set_value(self, key, value):
+        if key not in self.settings:
+            print(f"Not saving {key}: it is no longer in {self.filepath}")
+            return
+
         if value != self.settings[key]["value"]:
             self.settings[key]["value"] = value
-            self.save_settings()
-            if self.notify_callback:
-                self.notify_callback(self, key, value)
+            self.queue_save(key)
 
             if key in self.bindings:
                 for info in self.bindings[key]:
@@ -116,11 +164,15 @@ class JSONSettingsHandler(object):
                     callback(key, value)
 
     def get_property(self, key, prop):
+        if key not in self.settings:
+            print(f"Not reading {key}: it is no longer in {self.filepath}")
+            return None
+
         props = self.settings[key]
         return props[prop]
 
     def has_property(self, key, prop):
-        return prop in self.settings[key]
+        return key in self.settings and prop in self.settings[key]
 
     def has_key(self, key):
         return key in self.settings
@@ -153,41 +205,145 @@ class JSONSettingsHandler(object):
 
     def check_settings(self, *args):
         self.timeout_id = 0
+
+        try:
+            if get_file_identity(os.stat(self.filepath)) == self.file_identity:
+                return GLib.SOURCE_REMOVE
+
+            identity, file_hash, raw_data = self.read_settings_file()
+        except OSError as e:
+            print(f"Could not read {self.filepath}: {e}")
+            return GLib.SOURCE_REMOVE
+
+        if file_hash == self.file_hash:
+            # touched, or rewritten with the same contents
+            self.file_identity = identity
+            return GLib.SOURCE_REMOVE
+
+        try:
+            new_settings = self.parse_settings(raw_data)
+        except Exception as e:
+            # most likely caught halfway through being written, the rest of the write brings us back here
+            print(e)
+            return GLib.SOURCE_REMOVE
+
+        self.file_identity = identity
+        self.file_hash = file_hash
+
         old_settings = self.settings
-        self.settings = self.get_settings()
 
-        for key in self.bindings:
-            new_value = self.settings[key]["value"]
-            if new_value != old_settings[key]["value"]:
-                for info in self.bindings[key]:
-                    self.set_object_value(info, new_value)
+        # Changes that haven't been written yet are kept on top of the new
+        # file, the rest of it wins.
+        if self.changed_all:
+            pending = list(old_settings.keys())
+        else:
+            pending = self.changed_keys
+        for key in pending:
+            old_props = old_settings.get(key)
+            new_props = new_settings.get(key)
+            if isinstance(old_props, dict) and isinstance(new_props, dict) and "value" in old_props and "value" in new_props:
+                new_props["value"] = old_props["value"]
+
+        self.settings = new_settings
+        self.changed_keys = [key for key in self.changed_keys if key in new_settings]
+
+        # Keys that were removed are left alone, their widgets keep showing the last value.
+        for key in get_changed_keys(old_settings, new_settings):
+            self.do_key_update(key)
+
+        self.flush()
 
-        for key, callback_list in self.listeners.items():
-            new_value = self.settings[key]["value"]
-            if new_value != old_settings[key]["value"]:
-                for callback in callback_list:
-                    callback(key, new_value)
         return GLib.SOURCE_REMOVE
 
-    def get_settings(self):
-        file = open(self.filepath)
-        raw_data = file.read()
-        file.close()
+    def read_settings_file(self):
+        """Returns the identity of the settings file, the hash of its contents
+        and the contents."""
+        with open(self.filepath, 'rb') as file:
+            identity = get_file_identity(os.fstat(file.fileno()))
+            raw_data = file.read()
+        return identity, hashlib.sha256(raw_data).digest(), raw_data
+
+    def parse_settings(self, raw_data):
         try:
             settings = json.loads(raw_data, object_pairs_hook=collections.OrderedDict)
         except:
             raise Exception(f"Failed to parse settings JSON data for file {self.filepath}")
         return settings
 
+    def get_settings(self):
+        identity, file_hash, raw_data = self.read_settings_file()
+        return self.parse_settings(raw_data)
+
+    def queue_save(self, key=None):
+        """Saves the settings and notifies about key a little later, so that
+        a burst of changes (like dragging a slider) is written once. No key
+        means any of them may have changed."""
+        if key is None:
+            self.changed_all = True
+        elif key not in self.changed_keys:
+            self.changed_keys.append(key)
+
+        if self.save_id == 0:
+            self.save_id = GLib.timeout_add(SAVE_DELAY_MS, self.on_save_timeout)
+
+    def on_save_timeout(self):
+        self.save_id = 0
+        self.flush()
+        return GLib.SOURCE_REMOVE
+
+    def flush(self):
+        """Writes out any queued changes right away."""
+        if self.save_id > 0:
+            GLib.source_remove(self.save_id)
+            self.save_id = 0
+
+        if not self.changed_all and len(self.changed_keys) == 0:
+            return
+
+        changed_keys = self.changed_keys
+        changed_all = self.changed_all
+        self.changed_keys = []
+        self.changed_all = False
+
+        self.save_settings()
+
+        if self.notify_callback:
+            # Cinnamon re-reads the whole file for each notification, so one per write is enough.
+            if changed_all or len(changed_keys) > 1:
+                self.notify_callback(self, "", "")
+            else:
+                key = changed_keys[0]
+                self.notify_callback(self, key, self.settings[key]["value"])
+
     def save_settings(self):
+        # Write a temporary file next to the real one and rename it over it, so
+        # that the file is never seen half written.
         self.pause_monitor()
-        if os.path.exists(self.filepath):
-            os.remove(self.filepath)
-        raw_data = json.dumps(self.settings, indent=4, ensure_ascii=False)
-        with open(self.filepath, 'w+') as new_file:
-            new_file.write(raw_data)
-            new_file.flush()
-        self.resume_monitor()
+        try:
+            target = os.path.realpath(self.filepath)
+            try:
+                mode = stat.S_IMODE(os.stat(target).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+
+            raw_data = json.dumps(self.settings, indent=4, ensure_ascii=False)
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(target),
+                                             prefix='.' + os.path.basename(target) + '-', delete=False) as new_file:
+                new_file.write(raw_data)
+                new_file.flush()
+                os.fchmod(new_file.fileno(), mode)
+
+            try:
+                os.replace(new_file.name, target)
+            except OSError:
+                os.remove(new_file.name)
+                raise
+
+            # so that the change notification for our own write is ignored
+            self.file_identity = get_file_identity(os.stat(target))
+            self.file_hash = hashlib.sha256(raw_data.encode('utf-8')).digest()
+        finally:
+            self.resume_monitor()
 
     def reset_to_defaults(self):
         for key in self.settings:
@@ -195,9 +351,8 @@ class JSONSettingsHandler(object):
                 self.settings[key]["value"] = self.settings[key]["default"]
                 self.do_key_update(key)
 
-        self.save_settings()
-        if self.notify_callback:
-            self.notify_callback(self, "", "")
+        self.queue_save()
+        self.flush()
 
     def do_key_update(self, key):
         if key in self.bindings:
@@ -225,9 +380,8 @@ class JSONSettingsHandler(object):
                 self.do_key_update(key)
             else:
                 print(f"Skipping key {key}: the key does not exist in {filepath} or has no value")
-        self.save_settings()
-        if self.notify_callback:
-            self.notify_callback(self, "", "")
+        self.queue_save()
+        self.flush()
 
     def save_to_file(self, filepath):
         if os.path.exists(filepath):
@@ -12,6 +12,7 @@ from xapp.GSettingsWidgets import PXGSettingsBackend
 from bin.ChooserButtonWidgets import DateChooserButton, TimeChooserButton
 from bin.KeybindingWidgets import ButtonKeybinding
 from bin import util
+from bin import profiler
 
 from bin import KeybindingTable
 
@@ -214,7 +215,8 @@ class SidePage(object):
             self.content_box.remove(widget)
 
         if self.module is not None:
-            self.module.on_module_selected()
+            with profiler.span("module-selected", self.name):
+                self.module.on_module_selected()
             self.module.loaded = True
 
         if self.is_standalone:
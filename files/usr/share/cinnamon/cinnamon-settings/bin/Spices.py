@@ -186,6 +186,17 @@ class Spice_Harvester(GObject.Object):
 
         ui_thread_do(self._set_progressbar_fraction, fraction)
 
+    def _update_batch_progress(self, downloaded, total_size):
+        """ Progress callback for batch installs: byte counts summed over every
+            concurrent download. Raise AbortedError to halt the batch."""
+        if self._is_aborted():
+            raise AbortedError()
+
+        fraction = min(downloaded / total_size, 1.0) if total_size > 0 else 0
+        text = _("Downloading updates:") + f" {GLib.format_size(downloaded)}/{GLib.format_size(total_size)}"
+        ui_thread_do(self._set_progressbar_text, text)
+        ui_thread_do(self._set_progressbar_fraction, fraction)
+
     # Jobs are added by calling _push_job. _process_job and _advance_queue
     # form a wrapper that runs the job in its own thread.
     def _push_job(self, job):
@@ -350,8 +361,40 @@ class Spice_Harvester(GObject.Object):
 
     def update_all(self):
         """ applies all available updates"""
-        for uuid in list(self.updates_available):
-            self.install(uuid)
+        uuids = list(self.updates_available)
+        if len(uuids) == 1:
+            self.install(uuids[0])
+            return
+
+        _callback = None if self.actions else self._update_all_finished
+        job = {'uuids': uuids, 'func': self._update_all, 'callback': _callback}
+        job['progress_text'] = _("Applying updates")
+        self._push_job(job)
+
+    def _update_all(self, job):
+        try:
+            failures = self._h.install_many(job['uuids'], progress_callback=self._update_batch_progress)
+        except AbortedError as e:
+            # still reload the ones that made it
+            return list(e.installed) or None
+        except Exception as e:
+            if not self.abort_download:
+                self.errorMessage(_("An error occurred while trying to access the server. Please try again in a little while."), str(e))
+                self.abort(ABORT_ERROR)
+            return None
+
+        if failures and not self.abort_download:
+            uuids = ", ".join(failures)
+            details = "\n".join(f"{uuid}: {error}" for uuid, error in failures.items())
+            self.errorMessage(_("An error occurred during the installation of %s. Please report this incident to its developer.") % uuids, details)
+
+        return [uuid for uuid in job['uuids'] if uuid not in failures]
+
+    def _update_all_finished(self, job):
+        if job.get('result') is None:
+            return
+        for uuid in job['result']:
+            self._install_finished({'uuid': uuid, 'result': True})
 
     def abort(self, abort_type=ABORT_USER):
         """ trigger in-progress download to halt"""
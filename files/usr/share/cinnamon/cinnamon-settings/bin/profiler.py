@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# Startup and navigation profiling for cinnamon-settings.
+#
+# Enabled with --profile [FILE] or by setting CINNAMON_SETTINGS_PROFILE (to a
+# file name, or to 1 for the default location). The trace is written in the
+# Chrome trace event format, which about:tracing and ui.perfetto.dev can open,
+# and a summary of the slowest steps is printed to stderr.
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from gi.repository import GLib
+
+ENV_VAR = "CINNAMON_SETTINGS_PROFILE"
+DEFAULT_TRACE_FILE = os.path.join(GLib.get_user_cache_dir(), "cinnamon", "settings-profile.json")
+SUMMARY_LENGTH = 15
+
+# Everything is timed from when this module was first imported, which is
+# right at the start of cinnamon-settings.
+_origin = time.monotonic()
+_profiler = None
+
+
+class Profiler:
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+
+    def add(self, category, name, start, end=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X" if end is not None else "i",
+            "ts": round((start - _origin) * 1e6),
+            "pid": os.getpid(),
+            "tid": 0
+        }
+        if end is not None:
+            event["dur"] = round((end - start) * 1e6)
+        else:
+            event["s"] = "p"
+
+        self.events.append(event)
+
+    def write(self):
+        trace = {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms"
+        }
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(trace, f, indent=1)
+        except OSError as e:
+            print(f"Could not write the profile to {self.path}: {e}", file=sys.stderr)
+            return
+
+        spans = sorted((e for e in self.events if e["ph"] == "X"), key=lambda e: e["dur"], reverse=True)
+        print(f"cinnamon-settings profile written to {self.path}", file=sys.stderr)
+        for event in self.events:
+            if event["ph"] == "i":
+                print(f"  {event['ts'] / 1000:9.1f} ms  {event['cat']}: {event['name']}", file=sys.stderr)
+        print("  slowest steps:", file=sys.stderr)
+        for event in spans[:SUMMARY_LENGTH]:
+            print(f"  {event['dur'] / 1000:9.1f} ms  {event['cat']}: {event['name']}", file=sys.stderr)
+
+
+def enable(path=None):
+    """Starts recording. path is where the trace goes, the default location
+    if it's empty or None."""
+    global _profiler
+    _profiler = Profiler(path or DEFAULT_TRACE_FILE)
+
+
+def enable_from_env():
+    value = os.environ.get(ENV_VAR)
+    if value:
+        enable(None if value == "1" else value)
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+@contextmanager
+def span(category, name):
+    """Records how long the body of the with statement takes."""
+    if _profiler is None:
+        yield
+        return
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _profiler.add(category, name, start, time.monotonic())
+
+
+def mark(category, name):
+    """Records a point in time, like the first frame being drawn."""
+    if _profiler is not None:
+        _profiler.add(category, name, time.monotonic())
+
+
+def write():
+    if _profiler is not None:
+        _profiler.write()
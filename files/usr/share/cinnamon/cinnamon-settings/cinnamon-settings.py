@@ -1,4 +1,5 @@
 #!/usr/bin/python3
+from bin import profiler
 from bin import util
 util.strip_syspath_locals()
 
@@ -6,6 +7,7 @@ import argparse
 from functools import cmp_to_key
 import gettext
 import glob
+import json
 import locale
 import os
 from setproctitle import setproctitle
@@ -27,6 +29,10 @@ CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
 PYTHON_CS_MODULE_PATH = os.path.join(CURRENT_PATH, "modules")
 PYTHON_CS_MODULE_GLOB = os.path.join(PYTHON_CS_MODULE_PATH, "cs_*.py")
 PYTHON_CS_MODULES = [Path(file).stem for file in glob.glob(PYTHON_CS_MODULE_GLOB)]
+# What the overview needs to know about the python modules, so they can be
+# imported when their page is opened rather than all of them at startup.
+MODULE_MANIFEST_FILE = os.path.join(GLib.get_user_cache_dir(), "cinnamon", "settings-modules.json")
+MODULE_MANIFEST_VERSION = 1
 sys.path.append(PYTHON_CS_MODULE_PATH)
 from bin import capi
 from bin import SettingsWidgets
@@ -47,6 +53,22 @@ class SidePageData(typing.NamedTuple):
     cat: str
 
 
+class LazySidePage(SettingsWidgets.SidePage):
+    """Stands in for the side page of a python module in the overview, from
+    its manifest entry. The module is imported on the first load()."""
+    def __init__(self, entry, content_box):
+        super().__init__(entry["label"], entry["icon"], entry["keywords"], content_box)
+        self.module_name = entry["module"]
+        self.page = None
+
+    def load(self, main_window):
+        if self.page is None:
+            mod = main_window.load_python_module(self.module_name)
+            if mod is not None:
+                self.page = mod.sidePage
+        return self.page
+
+
 WIN_WIDTH = 800
 WIN_HEIGHT = 600
 WIN_H_PADDING = 20
@@ -58,6 +80,14 @@ MAX_PIX_WIDTH = 160
 
 MOUSE_BACK_BUTTON = 8
 
+# Search terms at least this long also match words with one typo in them
+SEARCH_FUZZY_MIN_LENGTH = 4
+# How well a search term matches a page, lower is better
+SEARCH_RANK_NAME_PREFIX = 0
+SEARCH_RANK_KEYWORD_PREFIX = 1
+SEARCH_RANK_SUBSTRING = 2
+SEARCH_RANK_FUZZY = 3
+
 CATEGORIES = [
     #        Display name                         ID           Show it?False to start  Icon
     {"label": _("Appearance"),            "id": "appear",      "show": False,          "icon": "cs-cat-appearance"},
@@ -166,20 +196,74 @@ def print_timing(func):
     return wrapper
 
 
+def strip_accents(text):
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join([c for c in text if not unicodedata.combining(c)])
+
+
+def normalize_search_text(text):
+    return strip_accents(text.lower())
+
+
+def split_search_words(text):
+    return [word for word in text.replace(",", " ").split() if word]
+
+
+def within_one_edit(a, b):
+    # True if a and b differ by at most one inserted, deleted or replaced character
+    if abs(len(a) - len(b)) > 1:
+        return False
+
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+
+    return a[i + 1:] == b[i + 1:] or a[i:] == b[i + 1:] or a[i + 1:] == b[i:]
+
+
+class SearchIndexEntry:
+    """A side page's name and keywords, normalized for searching."""
+    def __init__(self, sidePage):
+        self.name = normalize_search_text(sidePage.name)
+        self.keywords = normalize_search_text(sidePage.keywords)
+        self.name_words = split_search_words(self.name)
+        self.keyword_words = split_search_words(self.keywords)
+
+    def rank(self, term):
+        """How well term matches, or None if it doesn't."""
+        if any(word.startswith(term) for word in self.name_words):
+            return SEARCH_RANK_NAME_PREFIX
+        if any(word.startswith(term) for word in self.keyword_words):
+            return SEARCH_RANK_KEYWORD_PREFIX
+        if term in self.name or term in self.keywords:
+            return SEARCH_RANK_SUBSTRING
+        if len(term) >= SEARCH_FUZZY_MIN_LENGTH:
+            # compare with the start of each word, the user may still be typing
+            for word in self.name_words + self.keyword_words:
+                if within_one_edit(term, word[:len(term)]) or within_one_edit(term, word):
+                    return SEARCH_RANK_FUZZY
+        return None
+
+
 class MainWindow(Gio.Application):
     # Change pages
     def side_view_nav(self, side_view, path, cat):
         selected_items = side_view.get_selected_items()
         if len(selected_items) > 0:
             self.deselect(cat)
-            filtered_path = side_view.get_model().convert_path_to_child_path(selected_items[0])
-            if filtered_path is not None:
-                iterator = self.store_by_cat[cat].get_iter(filtered_path)
-                sidePage = self.store_by_cat[cat].get_value(iterator, 2)
-                self.go_to_sidepage(sidePage, user_action=True)
+            model = side_view.get_model()
+            iterator = model.get_iter(selected_items[0])
+            sidePage = model.get_value(iterator, 2)
+            self.go_to_sidepage(sidePage, user_action=True)
 
     def go_to_sidepage(self, sidePage: SettingsWidgets.SidePage, user_action=True):
-        sidePage.build()
+        if isinstance(sidePage, LazySidePage):
+            sidePage = sidePage.load(self)
+            if sidePage is None:
+                return
+
+        with profiler.span("build", sidePage.name):
+            sidePage.build()
 
         if sidePage.is_standalone:
             return  # we're done
@@ -258,6 +342,7 @@ class MainWindow(Gio.Application):
         Gio.Application.__init__(self,
                                  application_id=f"org.cinnamon.Settings_{os.getpid()}",
                                  flags=Gio.ApplicationFlags.NON_UNIQUE | Gio.ApplicationFlags.HANDLES_OPEN)
+        profiler.mark("startup", "main window")
         self.builder = Gtk.Builder()
         self.builder.set_translation_domain('cinnamon')  # let it translate!
         self.builder.add_from_file(os.path.join(CURRENT_PATH, "cinnamon-settings.ui"))
@@ -317,6 +402,14 @@ class MainWindow(Gio.Application):
 
         self.store_by_cat: typing.Dict[str, Gtk.ListStore] = {}
         self.storeFilter = {}
+        self.storeSorted = {}
+        self.category_widgets = {}
+
+        # side page -> SearchIndexEntry, and the alphabetical position of each page
+        self.search_index = {}
+        self.page_order = {}
+        # side page -> rank, for the pages matching the current search (None if there isn't one)
+        self.search_ranks = None
 
         # load CCC and standalone modules, but not python modules yet
         self.load_ccc_modules()
@@ -325,6 +418,9 @@ class MainWindow(Gio.Application):
         if not self.has_mintsources:
             self.load_standalone_modules(ALTERNATE_MODULES)
 
+        if profiler.is_enabled():
+            self.window.connect("draw", self.on_first_draw)
+
         # if a certain sidepage is given via arguments, try to load only it
         if parsed_args.module != None:
             if self.load_sidepage_as_standalone(parsed_args):
@@ -335,10 +431,14 @@ class MainWindow(Gio.Application):
     def init_settings_overview(self):
         """Load the system settings overview (default)
 
-        This requires to initialize all settings modules.
+        This only needs the python modules' manifest, if there is an up to
+        date one. Otherwise all of them are initialized, and the manifest
+        is written for the next time.
         """
         # 1. load all python modules
-        self.load_python_modules()
+        if not self.load_module_manifest():
+            self.load_python_modules()
+            self.save_module_manifest()
 
         # 2. sort the modules alphabetically according to the current locale
         localeStrKey = cmp_to_key(locale.strcoll)
@@ -370,6 +470,8 @@ class MainWindow(Gio.Application):
             self.min_pix_length = max(pix, self.min_pix_length)
             self.storeFilter[cat] = self.store_by_cat[cat].filter_new()
             self.storeFilter[cat].set_visible_func(self.filter_visible_function)
+            self.storeSorted[cat] = Gtk.TreeModelSort.new_with_model(self.storeFilter[cat])
+            self.storeSorted[cat].set_default_sort_func(self.compare_search_rank)
 
         self.min_label_length += 2
         self.min_pix_length += 4
@@ -380,6 +482,7 @@ class MainWindow(Gio.Application):
         self.min_label_length = min(self.min_label_length, MAX_LABEL_WIDTH)
         self.min_pix_length = min(self.min_pix_length, MAX_PIX_WIDTH)
 
+        self.build_search_index()
         self.displayCategories()
 
         # set up larger components.
@@ -459,16 +562,110 @@ class MainWindow(Gio.Application):
         else:
             to_import = PYTHON_CS_MODULES
 
-        for module in map(__import__, to_import):
-            try:
+        self.module_manifest = []
+        for module_name in to_import:
+            mod = self.load_python_module(module_name)
+            if mod is None:
+                continue
+
+            load_check = self.loadCheck(mod)
+            self.module_manifest.append({
+                "module": module_name,
+                "name": mod.name,
+                "label": mod.sidePage.name,
+                "icon": mod.sidePage.icon,
+                "category": mod.category,
+                "keywords": mod.sidePage.keywords,
+                "has_load_check": hasattr(mod, "_loadCheck"),
+                "load_check": load_check
+            })
+            if load_check:
+                self.sidePages.append(SidePageData(mod.sidePage, mod.name, mod.category))
+        return True
+
+    def load_python_module(self, module_name):
+        """Imports a settings module and sets up its Module, or returns None
+        if that fails."""
+        try:
+            with profiler.span("import", module_name):
+                module = __import__(module_name)
+            with profiler.span("init", module_name):
                 mod = module.Module(self.content_box)
-                if self.loadCheck(mod) and self.setParentRefs(mod):
+            self.setParentRefs(mod)
+            return mod
+        except:
+            print(f"failed to load python module {module_name}", file=sys.stderr)
+            traceback.print_exc()
+            return None
+
+    def get_module_manifest_key(self):
+        # The manifest holds translated strings, and goes stale with any
+        # change to the modules, the helpers they import or the translations.
+        files = []
+        for file in sorted(glob.glob(PYTHON_CS_MODULE_GLOB)) + sorted(glob.glob(os.path.join(CURRENT_PATH, "bin", "*.py"))):
+            stat = os.stat(file)
+            files.append([os.path.relpath(file, CURRENT_PATH), stat.st_mtime_ns, stat.st_size])
+
+        catalogs = []
+        for file in gettext.find("cinnamon", "/usr/share/locale", all=True):
+            stat = os.stat(file)
+            catalogs.append([file, stat.st_mtime_ns, stat.st_size])
+
+        lang = [os.environ.get(var, "") for var in ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")]
+        return {"files": files, "catalogs": catalogs, "lang": lang}
+
+    def load_module_manifest(self) -> bool:
+        try:
+            with open(MODULE_MANIFEST_FILE, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Could not read the settings module manifest: {e}")
+            return False
+
+        try:
+            if manifest.get("version") != MODULE_MANIFEST_VERSION or manifest.get("key") != self.get_module_manifest_key():
+                return False
+        except OSError:
+            return False
+
+        self.module_manifest = manifest["modules"]
+        for entry in self.module_manifest:
+            if entry["has_load_check"]:
+                # What a load check looks for can come and go without the
+                # module changing, so these are still checked every time.
+                mod = self.load_python_module(entry["module"])
+                entry["load_check"] = mod is not None and self.loadCheck(mod)
+                if entry["load_check"]:
                     self.sidePages.append(SidePageData(mod.sidePage, mod.name, mod.category))
-            except:
-                print(f"failed to load python module {module}", file=sys.stderr)
-                traceback.print_exc()
+            elif entry["load_check"]:
+                self.sidePages.append(SidePageData(LazySidePage(entry, self.content_box), entry["name"], entry["category"]))
         return True
 
+    def save_module_manifest(self):
+        manifest = {
+            "version": MODULE_MANIFEST_VERSION,
+            "key": self.get_module_manifest_key(),
+            "modules": self.module_manifest
+        }
+
+        tmp_path = MODULE_MANIFEST_FILE + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(MODULE_MANIFEST_FILE), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, MODULE_MANIFEST_FILE)
+        except OSError as e:
+            print(f"Could not save the settings module manifest: {e}")
+
+    def on_first_draw(self, widget, cr):
+        self.window.disconnect_by_func(self.on_first_draw)
+        profiler.mark("startup", "first frame")
+        # write out the startup profile once the frame is done
+        GLib.idle_add(profiler.write)
+        return False
+
     # If there are no arguments, do_active() is called, otherwise do_open().
     def do_activate(self):
         self.hold()
@@ -500,34 +697,80 @@ class MainWindow(Gio.Application):
         self.bar_heights = h
 
     def onSearchTextChanged(self, widget):
-        self.displayCategories()
+        self.apply_search()
 
     def onClearSearchBox(self, widget, position, event):
         if position == Gtk.EntryIconPosition.SECONDARY:
             self.search_entry.set_text("")
 
-    def strip_accents(self, text):
-        text = unicodedata.normalize('NFKD', text)
-        return ''.join([c for c in text if not unicodedata.combining(c)])
+    def build_search_index(self):
+        for (position, sidepage) in enumerate(self.sidePages):
+            self.search_index[sidepage.sp] = SearchIndexEntry(sidepage.sp)
+            self.page_order[sidepage.sp] = position
 
-    def filter_visible_function(self, model, iter, user_data = None):
-        sidePage = model.get_value(iter, 2)
-        text = self.strip_accents(self.search_entry.get_text().lower())
-        if self.strip_accents(sidePage.name.lower()).find(text) > -1 or \
-           self.strip_accents(sidePage.keywords.lower()).find(text) > -1:
-            return True
+    def apply_search(self):
+        terms = split_search_words(normalize_search_text(self.search_entry.get_text()))
+
+        if len(terms) == 0:
+            self.search_ranks = None
         else:
-            return False
+            # every term has to match, the better they do the earlier the page shows
+            self.search_ranks = {}
+            for (sidePage, entry) in self.search_index.items():
+                total = 0
+                for term in terms:
+                    rank = entry.rank(term)
+                    if rank is None:
+                        break
+                    total += rank
+                else:
+                    self.search_ranks[sidePage] = total
+
+        for cat in self.storeFilter:
+            self.storeFilter[cat].refilter()
+            # re-sort the pages that stayed visible
+            self.storeSorted[cat].set_default_sort_func(self.compare_search_rank)
+
+        self.update_category_visibility()
+
+    def filter_visible_function(self, model, iter, user_data = None):
+        return self.search_ranks is None or model.get_value(iter, 2) in self.search_ranks
+
+    def compare_search_rank(self, model, a, b, user_data=None):
+        page_a = model.get_value(a, 2)
+        page_b = model.get_value(b, 2)
+
+        if self.search_ranks is not None:
+            rank_a = self.search_ranks.get(page_a, 0)
+            rank_b = self.search_ranks.get(page_b, 0)
+            if rank_a != rank_b:
+                return rank_a - rank_b
+
+        return self.page_order.get(page_a, 0) - self.page_order.get(page_b, 0)
 
     def displayCategories(self):
-        widgets = self.side_view_container.get_children()
-        for widget in widgets:
-            widget.destroy()
-        self.first_category_done = False # This is just to prevent an extra separator showing up before the first category
+        # The category widgets are made once, searching only hides and shows them.
         for category in CATEGORIES:
             if category["show"] is True:
                 self.prepCategory(category)
         self.side_view_container.show_all()
+        self.update_category_visibility()
+
+    def update_category_visibility(self):
+        first_category_done = False # This is just to prevent an extra separator showing up before the first category
+        for category in CATEGORIES:
+            if category["id"] not in self.category_widgets:
+                continue
+
+            separator, header, view = self.category_widgets[category["id"]]
+            visible = self.storeFilter[category["id"]].iter_n_children(None) > 0
+
+            separator.set_visible(visible and first_category_done)
+            header.set_visible(visible)
+            view.set_visible(visible)
+
+            if visible:
+                first_category_done = True
 
     def get_label_min_width(self, model):
         min_width_chars = 0
@@ -553,12 +796,8 @@ class MainWindow(Gio.Application):
             cell.set_property('surface', wrapper.surface)
 
     def prepCategory(self, category):
-        self.storeFilter[category["id"]].refilter()
-        if not self.anyVisibleInCategory(category):
-            return
-        if self.first_category_done:
-            widget = Gtk.Separator.new(Gtk.Orientation.HORIZONTAL)
-            self.side_view_container.pack_start(widget, False, False, 10)
+        separator = Gtk.Separator.new(Gtk.Orientation.HORIZONTAL)
+        self.side_view_container.pack_start(separator, False, False, 10)
 
         box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 4)
         img = Gtk.Image.new_from_icon_name(category["icon"], Gtk.IconSize.BUTTON)
@@ -569,7 +808,7 @@ class MainWindow(Gio.Application):
         widget.set_markup(f'<span size="12000">{category["label"]}</span>')
         box.pack_start(widget, False, False, 1)
         self.side_view_container.pack_start(box, False, False, 0)
-        widget = Gtk.IconView.new_with_model(self.storeFilter[category["id"]])
+        widget = Gtk.IconView.new_with_model(self.storeSorted[category["id"]])
 
         area = widget.get_area()
 
@@ -592,7 +831,7 @@ class MainWindow(Gio.Application):
 
         self.side_view[category["id"]] = widget
         self.side_view_container.pack_start(self.side_view[category["id"]], False, False, 0)
-        self.first_category_done = True
+        self.category_widgets[category["id"]] = (separator, box, widget)
         self.side_view[category["id"]].connect("item-activated", self.side_view_nav, category["id"])
         self.side_view[category["id"]].connect("button-release-event", self.button_press, category["id"])
         self.side_view[category["id"]].connect("keynav-failed", self.on_keynav_failed, category["id"])
@@ -700,16 +939,6 @@ class MainWindow(Gio.Application):
         if event.button == 1:
             self.side_view_nav(widget, None, category)
 
-    def anyVisibleInCategory(self, category):
-        id = category["id"]
-        iter = self.storeFilter[id].get_iter_first()
-        visible = False
-        while iter is not None:
-            cat = self.storeFilter[id].get_value(iter, 3)
-            visible = cat == category["id"]
-            iter = self.storeFilter[id].iter_next(iter)
-        return visible
-
     def setParentRefs (self, mod):
         try:
             mod._setParentRef(self.window)
@@ -744,6 +973,8 @@ class MainWindow(Gio.Application):
         self.current_sidepage = None
 
     def _quit(self, *args):
+        # the startup profile, now with whatever pages were opened since
+        profiler.write()
         self.window.destroy()
         self.quit()
 
@@ -780,8 +1011,14 @@ SORT_TYPE can be specified by number or name as follows:
     parser.add_argument('-t', '--tab', type=str, help='Open a specific tab in the settings module. You can specify name or index.')
     parser.add_argument('-s', '--sort', type=str, choices=sort_options, metavar="SORT_TYPE", help="If opening an xlet module, sort the items by a specific criteria.")
     parser.add_argument('-p', '--panel', type=str, metavar="PANEL_ID", help="If opening the panel or applets module, specify a starting panel by its id")
+    parser.add_argument('--profile', type=str, nargs="?", const="", metavar="FILE", help=f"Time startup and page loading, and write a trace to FILE (default {profiler.DEFAULT_TRACE_FILE}). Setting {profiler.ENV_VAR} to a file name (or 1) does the same.")
     args = parser.parse_args()
 
+    if args.profile is not None:
+        profiler.enable(args.profile)
+    else:
+        profiler.enable_from_env()
+
     def find_module_name(name):
         return f"cs_{name}" in PYTHON_CS_MODULES or name in [item[1] for item in CONTROL_CENTER_MODULES]
 
@@ -5,12 +5,16 @@ import gettext
 import _thread as thread
 import subprocess
 import locale
-import time
 import hashlib
+import json
 import mimetypes
-import pickle
+import mmap
+import multiprocessing
 import shutil
-from io import BytesIO
+import struct
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from xml.etree import ElementTree
 
 from PIL import Image
@@ -48,10 +52,15 @@ CONFIG_FOLDER = os.path.join(GLib.get_user_config_dir(), 'cinnamon', 'background
 OLD_CONFIG_FOLDER = os.path.expanduser("~/.cinnamon/backgrounds")
 USER_FOLDERS_FILE_NAME = 'user-folders.lst'
 
-# even though pickle supports higher protocol versions, we want to version 2 because it's the latest
-# version supported by python2 which (at this time) is still used by older versions of Cinnamon.
-# When those versions are no longer supported, we can consider using a newer version.
-PICKLE_PROTOCOL_VERSION = 2
+THUMBNAIL_CACHE_FOLDER = os.path.join(GLib.get_user_cache_dir(), 'cs_backgrounds')
+THUMBNAIL_PACK_FILE_NAME = 'thumbnails.pack'
+THUMBNAIL_ORDER_FILE_NAME = 'thumbnails.order'
+# Least recently used thumbnails are evicted once the pack grows past this.
+THUMBNAIL_PACK_MAX_SIZE = 128 * 1024 * 1024
+THUMBNAIL_WORKERS = os.cpu_count() or 1
+# Rasterized with GdkPixbuf, so these are rendered in-process rather than
+# in the thumbnail process pool.
+GDK_PIXBUF_MIMETYPES = ("image/svg+xml", "image/avif", "image/jxl")
 
 (STORE_IS_SEPARATOR, STORE_ICON, STORE_NAME, STORE_PATH, STORE_TYPE) = range(5)
 
@@ -569,12 +578,291 @@ class Module:
             print(detail)
             return []
 
+def generate_thumbnail(filename, mimetype, size):
+    """
+    Render the icon view thumbnail for an image file.
+
+    :return: (rgba_bytes, thumb_width, thumb_height, width, height), where
+             width and height are those of the original image
+    """
+    if mimetype in GDK_PIXBUF_MIMETYPES:
+        # rasterize svg with Gdk-Pixbuf and convert to PIL Image
+        tmp_pix = GdkPixbuf.Pixbuf.new_from_file(filename)
+        mode = "RGBA" if tmp_pix.props.has_alpha else "RGB"
+        img = Image.frombytes(mode, (tmp_pix.props.width, tmp_pix.props.height),
+                              tmp_pix.read_pixel_bytes().get_data(), "raw",
+                              mode, tmp_pix.props.rowstride)
+    else:
+        img = Image.open(filename)
+        img = apply_orientation(img)
+
+    # generate thumbnail
+    (width, height) = img.size
+    if img.mode != "RGB":
+        if img.mode == "RGBA":
+            bg_img = Image.new("RGBA", img.size, (255,255,255,255))
+            img = Image.alpha_composite(bg_img, img)
+        img = img.convert("RGB")
+    if size:
+        img.thumbnail((size, size), Image.LANCZOS)
+
+    from bin import imtools
+    img = imtools.round_image(img, {}, False, None, 3, 255)
+    img = imtools.drop_shadow(img, 4, 4, background_color=(255, 255, 255, 0),
+                              shadow_color=0x444444, border=8, shadow_blur=3,
+                              force_background_color=False, cache=None)
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    return (img.tobytes(), img.size[0], img.size[1], width, height)
+
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = thread.allocate_lock()
+# set by shutdown_thumbnail_pool(), after which no new pool is started
+_thumbnail_pool_closed = False
+
+def render_thumbnail(filename, mimetype, size):
+    """
+    generate_thumbnail, run in a pool of worker processes: decoding and
+    resizing with PIL holds the GIL, so threads alone only use one core.
+    """
+    global _thumbnail_pool
+
+    if mimetype in GDK_PIXBUF_MIMETYPES:
+        return generate_thumbnail(filename, mimetype, size)
+
+    with _thumbnail_pool_lock:
+        if _thumbnail_pool is None and not _thumbnail_pool_closed:
+            # Workers come from a fork server rather than from this process:
+            # forking a multithreaded GTK process can deadlock the child.
+            _thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                                  mp_context=multiprocessing.get_context("forkserver"))
+        pool = _thumbnail_pool
+
+    if pool is None:
+        # the view is gone, finish the loads still in flight here
+        return generate_thumbnail(filename, mimetype, size)
+
+    try:
+        return pool.submit(generate_thumbnail, filename, mimetype, size).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. was OOM killed); start a fresh pool next time
+        with _thumbnail_pool_lock:
+            if _thumbnail_pool is pool:
+                _thumbnail_pool = None
+        return generate_thumbnail(filename, mimetype, size)
+    except (RuntimeError, CancelledError):
+        # the pool was shut down under us
+        return generate_thumbnail(filename, mimetype, size)
+
+def shutdown_thumbnail_pool():
+    global _thumbnail_pool, _thumbnail_pool_closed
+
+    with _thumbnail_pool_lock:
+        pool = _thumbnail_pool
+        _thumbnail_pool = None
+        _thumbnail_pool_closed = True
+
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ThumbnailPack(object):
+    """
+    Disk cache of rendered thumbnails as raw RGBA pixels, appended to a single
+    memory-mapped pack file. Each record is a fixed header followed by the
+    pixel data; the index is rebuilt from the headers when the pack is opened.
+
+    The pack is kept in least recently used order: when it grows past
+    max_size it is rewritten with only the most recently used thumbnails,
+    oldest first. Lookups change the order without touching the pack, so
+    the order is saved next to it by save_order().
+    """
+
+    HEADER = struct.Struct("<4s40s6I")
+    MAGIC = b"CSB1"
+
+    def __init__(self, folder, max_size):
+        self._folder = folder
+        self._path = os.path.join(folder, THUMBNAIL_PACK_FILE_NAME)
+        self._order_path = os.path.join(folder, THUMBNAIL_ORDER_FILE_NAME)
+        self._max_size = max_size
+        self._lock = thread.allocate_lock()
+        # (key, size) -> (data offset, width, height, orig width, orig height, length)
+        self._index = OrderedDict()
+        self._file = None
+        self._mmap = None
+        self._end = 0
+        self._order_changed = False
+
+    def get(self, key, size):
+        with self._lock:
+            self._ensure_open()
+            entry = self._index.get((key, size))
+            if entry is None:
+                return None
+            self._index.move_to_end((key, size))
+            self._order_changed = True
+
+            (offset, width, height, orig_width, orig_height, length) = entry
+            if self._mmap is None or len(self._mmap) < offset + length:
+                self._remap()
+            # a bytes slice: PyGObject copies bytes into the GBytes in one go,
+            # anything else element by element
+            data = GLib.Bytes.new(self._mmap[offset:offset + length])
+
+        return (data, width, height, orig_width, orig_height)
+
+    def put(self, key, size, data, thumb_size, orig_size):
+        with self._lock:
+            self._ensure_open()
+            (width, height) = thumb_size
+            (orig_width, orig_height) = orig_size
+            header = self.HEADER.pack(self.MAGIC, key.encode(), size or 0,
+                                      width, height, orig_width, orig_height, len(data))
+            self._file.seek(self._end)
+            self._file.write(header)
+            self._file.write(data)
+            self._file.flush()
+
+            self._index[(key, size)] = (self._end + len(header), width, height,
+                                        orig_width, orig_height, len(data))
+            self._index.move_to_end((key, size))
+            self._order_changed = True
+            self._end += len(header) + len(data)
+
+            if self._end > self._max_size:
+                self._compact()
+
+    def save_order(self):
+        with self._lock:
+            if not self._order_changed:
+                return
+
+            order = {
+                "end": self._end,
+                "order": [[key, size] for (key, size) in self._index]
+            }
+            tmp_path = self._order_path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(order, f)
+                os.replace(tmp_path, self._order_path)
+                self._order_changed = False
+            except OSError as e:
+                print(f"Failed to save thumbnail cache order: {e}")
+
+    def _ensure_open(self):
+        if self._file is not None:
+            return
+
+        os.makedirs(self._folder, exist_ok=True)
+        if not os.path.exists(self._path):
+            self._remove_legacy_cache()
+
+        self._file = open(self._path, "a+b")
+        self._load_index()
+
+    def _load_index(self):
+        self._index.clear()
+        fd = self._file.fileno()
+        file_size = os.fstat(fd).st_size
+        offset = 0
+        while offset + self.HEADER.size <= file_size:
+            (magic, key, size, width, height, orig_width, orig_height, length) = \
+                self.HEADER.unpack(os.pread(fd, self.HEADER.size, offset))
+            data_offset = offset + self.HEADER.size
+            if magic != self.MAGIC or length != width * height * 4 or data_offset + length > file_size:
+                break
+            self._index[(key.decode(), size or None)] = (data_offset, width, height,
+                                                         orig_width, orig_height, length)
+            offset = data_offset + length
+
+        if offset != file_size:
+            # a write was interrupted, or the pack is corrupt from here on
+            print(f"Truncating thumbnail cache {self._path} at {offset} bytes")
+            self._file.truncate(offset)
+        self._end = offset
+        self._load_order()
+
+    def _load_order(self):
+        try:
+            with open(self._order_path, "r", encoding="utf-8") as f:
+                order = json.load(f)
+            saved_end = order["end"]
+            saved_order = [(key, size) for (key, size) in order["order"]]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Failed to read thumbnail cache order: {e}")
+            return
+
+        # Thumbnails added since the order was saved were used after everything in it.
+        newer = [item for (item, entry) in self._index.items() if entry[0] >= saved_end]
+        for item in saved_order + newer:
+            if item in self._index:
+                self._index.move_to_end(item)
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._end > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _compact(self):
+        if self._mmap is None or len(self._mmap) < self._end:
+            self._remap()
+
+        # keep the most recently used thumbnails, up to 3/4 of the cap
+        kept = []
+        kept_size = 0
+        for item in reversed(self._index.items()):
+            record_size = self.HEADER.size + item[1][5]
+            if kept_size + record_size > self._max_size * 3 // 4:
+                break
+            kept.append(item)
+            kept_size += record_size
+        kept.reverse()
+
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as tmp:
+            for ((key, size), (offset, width, height, orig_width, orig_height, length)) in kept:
+                tmp.write(self.HEADER.pack(self.MAGIC, key.encode(), size or 0,
+                                           width, height, orig_width, orig_height, length))
+                tmp.write(self._mmap[offset:offset + length])
+        os.replace(tmp_path, self._path)
+        # the rewritten pack is in use order already
+        try:
+            os.remove(self._order_path)
+        except FileNotFoundError:
+            pass
+        self._order_changed = False
+
+        self._mmap.close()
+        self._mmap = None
+        self._file.close()
+        self._file = open(self._path, "a+b")
+        self._load_index()
+
+    def _remove_legacy_cache(self):
+        # Thumbnails used to be stored as one pickled PNG per image.
+        for entry in os.listdir(self._folder):
+            if entry.endswith("v2"):
+                try:
+                    os.remove(os.path.join(self._folder, entry))
+                except OSError:
+                    pass
+
+
 class PixCache(object):
 
     def __init__(self):
         self._data = {}
+        self._pack = ThumbnailPack(THUMBNAIL_CACHE_FOLDER, THUMBNAIL_PACK_MAX_SIZE)
 
-    def get_pix(self, filename, size=None):
+    def get_pix(self, filename, size=None, renderer=generate_thumbnail):
         if filename is None:
             return None
         mimetype = mimetypes.guess_type(filename)[0]
@@ -587,67 +875,25 @@ class PixCache(object):
             pix = self._data[filename][size]
         else:
             try:
-                h = hashlib.sha1(('%f%s' % (os.path.getmtime(filename), filename)).encode()).hexdigest()
-                tmp_cache_path = GLib.get_user_cache_dir() + '/cs_backgrounds/'
-                if not os.path.exists(tmp_cache_path):
-                    os.mkdir(tmp_cache_path)
-                cache_filename = tmp_cache_path + h + "v2"
-
-                loaded = False
-                if os.path.exists(cache_filename):
-                    # load from disk cache
-                    try:
-                        with open(cache_filename, "rb") as cache_file:
-                            pix = pickle.load(cache_file)
-                        tmp_img = Image.open(BytesIO(pix[0]))
-                        pix[0] = self._image_to_pixbuf(tmp_img)
-                        loaded = True
-                    except Exception as detail:
-                        # most likely either the file is corrupted, or the file was pickled using the
-                        # python2 version of cinnamon settings. Either way, we want to ditch the current
-                        # cache file and generate a new one. This is still backward compatible with older
-                        # Cinnamon versions
-                        os.remove(cache_filename)
-
-                if not loaded:
-                    if mimetype in ("image/svg+xml", "image/avif", "image/jxl"):
-                        # rasterize svg with Gdk-Pixbuf and convert to PIL Image
-                        tmp_pix = GdkPixbuf.Pixbuf.new_from_file(filename)
-                        mode = "RGBA" if tmp_pix.props.has_alpha else "RGB"
-                        img = Image.frombytes(mode, (tmp_pix.props.width, tmp_pix.props.height),
-                                              tmp_pix.read_pixel_bytes().get_data(), "raw",
-                                              mode, tmp_pix.props.rowstride)
-                    else:
-                        img = Image.open(filename)
-                        img = apply_orientation(img)
-
-                    # generate thumbnail
-                    (width, height) = img.size
-                    if img.mode != "RGB":
-                        if img.mode == "RGBA":
-                            bg_img = Image.new("RGBA", img.size, (255,255,255,255))
-                            img = Image.alpha_composite(bg_img, img)
-                        img = img.convert("RGB")
-                    if size:
-                        img.thumbnail((size, size), Image.LANCZOS)
-
-
-                    from bin import imtools
-                    img = imtools.round_image(img, {}, False, None, 3, 255)
-                    img = imtools.drop_shadow(img, 4, 4, background_color=(255, 255, 255, 0),
-                                              shadow_color=0x444444, border=8, shadow_blur=3,
-                                              force_background_color=False, cache=None)
-
-                    # save to disk cache
+                key = hashlib.sha1(('%f%s' % (os.path.getmtime(filename), filename)).encode()).hexdigest()
+
+                cached = None
+                try:
+                    cached = self._pack.get(key, size)
+                except Exception as detail:
+                    print(f"Failed to read thumbnail cache: {detail}")
+
+                if cached is not None:
+                    (data, thumb_width, thumb_height, width, height) = cached
+                else:
+                    (rgba, thumb_width, thumb_height, width, height) = renderer(filename, mimetype, size)
                     try:
-                        png_bytes = BytesIO()
-                        img.save(png_bytes, "png")
-                        with open(cache_filename, "wb") as cache_file:
-                            pickle.dump([png_bytes.getvalue(), width, height], cache_file, PICKLE_PROTOCOL_VERSION)
+                        self._pack.put(key, size, rgba, (thumb_width, thumb_height), (width, height))
                     except Exception as detail:
-                        print(f"Failed to save cache file: {cache_filename}: {detail}")
+                        print(f"Failed to save thumbnail cache for {filename}: {detail}")
+                    data = GLib.Bytes.new(rgba)
 
-                    pix = [self._image_to_pixbuf(img), width, height]
+                pix = [self._bytes_to_pixbuf(data, thumb_width, thumb_height), width, height]
             except Exception as detail:
                 print(f"Failed to convert {filename}: {detail}")
                 pix = None
@@ -655,10 +901,15 @@ class PixCache(object):
                 self._data[filename][size] = pix
         return pix
 
-    # Convert RGBA PIL Image to Pixbuf
-    def _image_to_pixbuf(self, img):
-        [w, h] = img.size
-        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(img.tobytes()),
+    def save(self):
+        try:
+            self._pack.save_order()
+        except Exception as detail:
+            print(f"Failed to save thumbnail cache order: {detail}")
+
+    # Wrap raw RGBA pixels in a Pixbuf without decoding
+    def _bytes_to_pixbuf(self, data, w, h):
+        return GdkPixbuf.Pixbuf.new_from_bytes(data,
                                                GdkPixbuf.Colorspace.RGB,
                                                True, 8, w, h,
                                                w * 4)
@@ -690,18 +941,37 @@ class ThreadedIconView(Gtk.IconView):
         self.add_attribute(text_renderer, "markup", 2)
         text_renderer.set_property("alignment", Pango.Alignment.CENTER)
 
-        self._loading_queue = []
-        self._loading_queue_lock = thread.allocate_lock()
-
-        self._loading_lock = thread.allocate_lock()
-        self._loading = False
-
-        self._loaded_data = []
-        self._loaded_data_lock = thread.allocate_lock()
+        self._loader = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        # Bumped whenever the list is cleared, so results still in flight for
+        # a previous collection are dropped when they arrive.
+        self._generation = 0
+        # model row index -> picture, for thumbnails not requested yet
+        self._pending = OrderedDict()
+        self._failed = set()
+        self._in_flight = 0
+        self._refilter_id = 0
+
+        self._placeholder = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                                 BACKGROUND_ICONS_SIZE, BACKGROUND_ICONS_SIZE)
+        self._placeholder.fill(0)
+
+        self.connect("destroy", self.on_destroy)
+
+    def on_destroy(self, widget):
+        self._generation += 1
+        self._pending.clear()
+        if self._refilter_id > 0:
+            GLib.source_remove(self._refilter_id)
+            self._refilter_id = 0
+        self._loader.shutdown(wait=False, cancel_futures=True)
+        shutdown_thumbnail_pool()
+        PIX_CACHE.save()
 
     def visible_func(self, model, iter, data=None):
         item_path = model.get_value(iter, 3)
-        return item_path == self.current_path
+        if item_path != self.current_path:
+            return False
+        return model.get_path(iter).get_indices()[0] not in self._failed
 
     def set_pictures_list(self, pictures_list, path=None):
         self.clear()
@@ -710,86 +980,87 @@ class ThreadedIconView(Gtk.IconView):
             self.add_picture(i, path)
 
     def clear(self):
-        self._loading_queue_lock.acquire()
-        self._loading_queue = []
-        self._loading_queue_lock.release()
-
-        self._loading_lock.acquire()
-        is_loading = self._loading
-        self._loading_lock.release()
-        while is_loading:
-            time.sleep(0.1)
-            self._loading_lock.acquire()
-            is_loading = self._loading
-            self._loading_lock.release()
-
+        self._generation += 1
+        self._pending.clear()
+        self._failed.clear()
+        self._in_flight = 0
         self._model.clear()
 
     def add_picture(self, picture, path):
-        self._loading_queue_lock.acquire()
-        self._loading_queue.append(picture)
-        self._loading_queue_lock.release()
-
-        start_loading = False
-        self._loading_lock.acquire()
-        if not self._loading:
-            self._loading = True
-            start_loading = True
-        self._loading_lock.release()
-
-        if start_loading:
-            GLib.timeout_add(100, self._check_loading_progress)
-            thread.start_new_thread(self._do_load, (path,))
-
-    def _check_loading_progress(self):
-        self._loading_lock.acquire()
-        self._loaded_data_lock.acquire()
-        res = self._loading
-        to_load = []
-        while len(self._loaded_data) > 0:
-            to_load.append(self._loaded_data[0])
-            self._loaded_data = self._loaded_data[1:]
-        self._loading_lock.release()
-        self._loaded_data_lock.release()
-
-        for i in to_load:
-            self._model.append(i)
-
-        return res
-
-    def _do_load(self, path):
-        finished = False
-        while not finished:
-            self._loading_queue_lock.acquire()
-            if len(self._loading_queue) == 0:
-                finished = True
-            else:
-                to_load = self._loading_queue[0]
-                self._loading_queue = self._loading_queue[1:]
-            self._loading_queue_lock.release()
-            if not finished:
-                filename = to_load["filename"]
-                if filename.endswith(".xml"):
-                    filename = self.getFirstFileFromBackgroundXml(filename)
-                pix = PIX_CACHE.get_pix(filename, BACKGROUND_ICONS_SIZE)
-                if pix is not None:
-                    if "name" in to_load:
-                        label = to_load["name"]
-                    else:
-                        label = os.path.split(to_load["filename"])[1]
-                    if "artist" in to_load:
-                        artist = f"{to_load['artist']}\n"
-                    else:
-                        artist = ""
-                    dimensions = f"{pix[1]}x{pix[2]}"
-
-                    self._loaded_data_lock.acquire()
-                    self._loaded_data.append((to_load, pix[0], f"<b>{label}</b>\n<small>{artist}{dimensions}</small>", path))
-                    self._loaded_data_lock.release()
-
-        self._loading_lock.acquire()
-        self._loading = False
-        self._loading_lock.release()
+        filename = picture["filename"]
+        if not filename.endswith(".xml"):
+            mimetype = mimetypes.guess_type(filename)[0]
+            if mimetype is None or not mimetype.startswith("image/"):
+                return
+
+        index = self._model.iter_n_children(None)
+        self._model.append((picture, self._placeholder, self._get_markup(picture), path))
+        self._pending[index] = picture
+        self._load_next()
+
+    def _get_markup(self, picture, pix=None):
+        if "name" in picture:
+            label = picture["name"]
+        else:
+            label = os.path.split(picture["filename"])[1]
+        if "artist" in picture:
+            artist = f"{picture['artist']}\n"
+        else:
+            artist = ""
+        dimensions = f"{pix[1]}x{pix[2]}" if pix is not None else ""
+
+        return f"<b>{GLib.markup_escape_text(label)}</b>\n<small>{GLib.markup_escape_text(artist)}{dimensions}</small>"
+
+    def _load_next(self):
+        # Keep exactly one request per worker in flight, so the choice of what
+        # to load next always reflects the current scroll position.
+        while self._in_flight < THUMBNAIL_WORKERS and len(self._pending) > 0:
+            index = self._next_pending_index()
+            picture = self._pending.pop(index)
+            self._in_flight += 1
+            self._loader.submit(self._do_load, self._generation, index, picture)
+
+    def _next_pending_index(self):
+        # thumbnails currently on screen first, then in list order
+        visible = self.get_visible_range()
+        if visible is not None:
+            (start, end) = [self._model_filter.convert_path_to_child_path(p) for p in visible]
+            if start is not None and end is not None:
+                for index in range(start.get_indices()[0], end.get_indices()[0] + 1):
+                    if index in self._pending:
+                        return index
+        return next(iter(self._pending))
+
+    def _do_load(self, generation, index, picture):
+        pix = None
+        if generation == self._generation:
+            filename = picture["filename"]
+            if filename.endswith(".xml"):
+                filename = self.getFirstFileFromBackgroundXml(filename)
+            pix = PIX_CACHE.get_pix(filename, BACKGROUND_ICONS_SIZE, render_thumbnail)
+        GLib.idle_add(self._on_pix_loaded, generation, index, picture, pix)
+
+    def _on_pix_loaded(self, generation, index, picture, pix):
+        if generation != self._generation:
+            return GLib.SOURCE_REMOVE
+
+        self._in_flight -= 1
+        if pix is None:
+            # hide failures in one go rather than refiltering for each
+            self._failed.add(index)
+            if self._refilter_id == 0:
+                self._refilter_id = GLib.idle_add(self._refilter_failed, priority=GLib.PRIORITY_LOW)
+        else:
+            iter = self._model.iter_nth_child(None, index)
+            self._model.set(iter, {1: pix[0], 2: self._get_markup(picture, pix)})
+
+        self._load_next()
+        return GLib.SOURCE_REMOVE
+
+    def _refilter_failed(self):
+        self._refilter_id = 0
+        self._model_filter.refilter()
+        return GLib.SOURCE_REMOVE
 
     def getFirstFileFromBackgroundXml(self, filename):
         try:
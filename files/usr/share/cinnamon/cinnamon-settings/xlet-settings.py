@@ -536,10 +536,16 @@ class MainWindow(object):
         self.selected_instance["settings"].reset_to_defaults()
 
     def reload_xlet(self, *args):
+        for info in self.instance_info:
+            info["settings"].flush()
+
         if proxy:
             proxy.ReloadXlet('(ss)', self.uuid, self.type.upper())
 
     def quit(self, *args):
+        for info in self.instance_info:
+            info["settings"].flush()
+
         if proxy:
             proxy.highlightXlet('(ssb)', self.uuid, self.selected_instance["id"], False)
 
@@ -3,18 +3,53 @@
 import random
 import signal
 import os, locale
+import gzip
+import json
+import hashlib
+import math
+import threading
+from collections import deque
 from xml.etree import ElementTree
 from setproctitle import setproctitle
 
 import gi
 gi.require_version('GLibUnix', '2.0')
-from gi.repository import Gio, GLib, GLibUnix
+gi.require_version('Gdk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gio, GLib, GLibUnix, Gdk, GdkPixbuf
 
 SLIDESHOW_DBUS_NAME = "org.Cinnamon.Slideshow"
 SLIDESHOW_DBUS_PATH = "/org/Cinnamon/Slideshow"
 
 BACKGROUND_COLLECTION_TYPE_DIRECTORY = "directory"
 BACKGROUND_COLLECTION_TYPE_XML = "xml"
+BACKGROUND_COLLECTION_TYPE_RECURSIVE = "recursive"
+BACKGROUND_COLLECTION_DIRECTORY_TYPES = (BACKGROUND_COLLECTION_TYPE_DIRECTORY, BACKGROUND_COLLECTION_TYPE_RECURSIVE)
+
+SCAN_ATTRIBUTES = "standard::name,standard::type,standard::content-type,id::file"
+SCAN_BATCH_SIZE = 100
+# Caps the inotify watches used on subfolders of recursive collections.
+MAX_MONITORED_FOLDERS = 256
+
+# Snapshot of the scanned collection and the playback position, so a new
+# session resumes the rotation without waiting for a rescan.
+STATE_FILE = os.path.join(GLib.get_user_cache_dir(), "cinnamon", "slideshow-state.json.gz")
+STATE_VERSION = 2
+# A collection that changed since the snapshot is rescanned this long after
+# startup, so the scan doesn't compete with the rest of the session login.
+RESCAN_DELAY_SECONDS = 30
+
+# The next image is scaled down to the monitor geometry ahead of time and the
+# shell is handed the result, so it doesn't decode a full size photo at switch
+# time. Only the current and the upcoming images are needed, the rest is slack
+# for images that come round again soon. The copies live with the user's data
+# rather than in the cache, since picture-uri keeps pointing at one of them
+# after logging out (for the greeter and the next login).
+PRESCALE_CACHE_FOLDER = os.path.join(GLib.get_user_data_dir(), "cinnamon", "slideshow")
+# where they used to be
+OLD_PRESCALE_CACHE_FOLDER = os.path.join(GLib.get_user_cache_dir(), "cinnamon", "slideshow")
+PRESCALE_CACHE_MAX_FILES = 8
+PRESCALE_JPEG_QUALITY = "95"
 
 # D-Bus interface XML definition
 DBUS_INTERFACE_XML = '''
@@ -23,10 +58,177 @@ DBUS_INTERFACE_XML = '''
         <method name="begin" />
         <method name="end" />
         <method name="getNextImage" />
+        <method name="getCacheStats">
+            <arg type="u" name="hits" direction="out" />
+            <arg type="u" name="misses" direction="out" />
+        </method>
     </interface>
 </node>
 '''
 
+class Playlist:
+    """
+    The images of a slideshow collection, and which of them have already been
+    shown in the current cycle.
+
+    Images are kept in play order (sorted for directory collections, in file
+    order for xml ones) next to a uri -> position index, so membership tests,
+    removals and picking the next image never scan the list. Additions only
+    mark the order for re-sorting, which happens once before the next pick.
+    Shuffled playback walks a permutation computed at the start of each cycle
+    instead of drawing from a shrinking list.
+    """
+    def __init__(self, sort=False):
+        self.sort = sort
+        # play order; removed images leave a None behind until the next rebuild
+        self._order = []
+        self._positions = {}
+        self._used = set()
+        self._cursor = 0
+        self._shuffle = []
+        self._removed = 0
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._positions)
+
+    def uris(self):
+        self._rebuild_if_needed()
+        return [uri for uri in self._order if uri is not None]
+
+    def used_uris(self):
+        return list(self._used)
+
+    def restore(self, uris, used):
+        for uri in uris:
+            self.add(uri)
+        for uri in used:
+            if uri in self._positions:
+                self._used.add(uri)
+
+    def __contains__(self, uri):
+        return uri in self._positions
+
+    def add(self, uri):
+        if uri in self._positions:
+            return
+
+        self._positions[uri] = len(self._order)
+        self._order.append(uri)
+        if self.sort:
+            self._dirty = True
+
+        # Slot the new image into the remaining shuffle at a random position.
+        self._shuffle.append(uri)
+        swap = random.randrange(len(self._shuffle))
+        self._shuffle[-1], self._shuffle[swap] = self._shuffle[swap], self._shuffle[-1]
+
+    def remove(self, uri):
+        position = self._positions.pop(uri, None)
+        if position is None:
+            return
+
+        self._order[position] = None
+        self._used.discard(uri)
+        self._removed += 1
+        if self._removed > len(self._order) // 2:
+            self._dirty = True
+
+    def peek(self, random_order):
+        """The image next() would return, without marking it as shown."""
+        if len(self._positions) == 0:
+            return None
+
+        self._rebuild_if_needed()
+        if len(self._used) >= len(self._positions):
+            self._start_cycle()
+
+        if random_order:
+            # dropping stale entries here is what next() would do anyway
+            while self._shuffle[-1] not in self._positions or self._shuffle[-1] in self._used:
+                self._shuffle.pop()
+            return self._shuffle[-1]
+
+        cursor = self._cursor
+        uri = self._order[cursor]
+        while uri is None or uri in self._used:
+            cursor += 1
+            uri = self._order[cursor]
+        return uri
+
+    def next(self, random_order):
+        if len(self._positions) == 0:
+            return None
+
+        self._rebuild_if_needed()
+        if len(self._used) >= len(self._positions):
+            self._start_cycle()
+
+        # Both walks skip entries that were removed or already shown (through
+        # the other mode, if random-order was toggled mid-cycle).
+        if random_order:
+            uri = self._shuffle.pop()
+            while uri not in self._positions or uri in self._used:
+                uri = self._shuffle.pop()
+        else:
+            uri = self._order[self._cursor]
+            while uri is None or uri in self._used:
+                self._cursor += 1
+                uri = self._order[self._cursor]
+            self._cursor += 1
+
+        self._used.add(uri)
+        return uri
+
+    def skip_past(self, uri):
+        # Resume a sequential slideshow after uri, unless it is the last image,
+        # in which case the cycle starts over anyway. Returns whether uri is
+        # in the playlist.
+        self._rebuild_if_needed()
+        position = self._positions.get(uri)
+        if position is None:
+            return False
+        if position == len(self._order) - 1:
+            return True
+
+        for image in self._order[:position + 1]:
+            if image is not None:
+                self._used.add(image)
+        self._cursor = position + 1
+        return True
+
+    def _start_cycle(self):
+        self._used.clear()
+        self._cursor = 0
+        self._shuffle = list(self._positions)
+        random.shuffle(self._shuffle)
+
+    def _rebuild_if_needed(self):
+        if not self._dirty:
+            return
+
+        self._order = [uri for uri in self._order if uri is not None]
+        if self.sort:
+            self._order.sort()
+        self._positions = {uri: position for position, uri in enumerate(self._order)}
+        self._removed = 0
+        self._cursor = 0
+        self._dirty = False
+
+
+class CollectionScan:
+    def __init__(self, partial=False):
+        # a partial scan only adds the images of some new folders
+        self.partial = partial
+        self.cancellable = Gio.Cancellable()
+        # (path, recursive) of the folders still to enumerate
+        self.folders = deque()
+        self.seen_folders = set()
+        self.images = set()
+        # path -> mtime of every folder and xml file read, to detect changes
+        self.mtimes = {}
+
+
 class CinnamonSlideshowApplication(Gio.Application):
     def __init__(self):
         super().__init__(
@@ -40,18 +242,29 @@ class CinnamonSlideshowApplication(Gio.Application):
         if self.slideshow_settings.get_boolean("slideshow-paused"):
             self.slideshow_settings.set_boolean("slideshow-paused", False)
 
-        self.image_playlist = []
-        self.used_image_playlist = []
+        self.playlist = Playlist()
         self.images_ready = False
         self.update_in_progress = False
         self.starting_image = self.background_settings.get_string("picture-uri")
         self.current_image = self.starting_image
+        # the collection image behind current_image, which may be a pre-scaled copy
+        self.current_source = self.starting_image
 
         self.update_id = 0
         self.loop_counter = self.slideshow_settings.get_int("delay")
 
-        self.folder_monitor = None
-        self.folder_monitor_id = 0
+        self.sources = []
+        self.folder_monitors = {}
+
+        self.rescan_id = 0
+        self.scan = None
+        self.scanned_mtimes = None
+
+        self.next_image = None
+        self.prescaled = {}
+        self.prescale_generation = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
 
         self.connection = None
         self.registration_id = 0
@@ -126,6 +339,8 @@ class CinnamonSlideshowApplication(Gio.Application):
             elif method_name == "getNextImage":
                 self.get_next_image()
                 invocation.return_value(None)
+            elif method_name == "getCacheStats":
+                invocation.return_value(GLib.Variant("(uu)", (self.cache_hits, self.cache_misses)))
             else:
                 invocation.return_error_literal(
                     Gio.dbus_error_quark(),
@@ -152,6 +367,8 @@ class CinnamonSlideshowApplication(Gio.Application):
             self.cinnamon_watch_id = 0
 
         self.disconnect_folder_monitor()
+        self.cancel_scan()
+        self.save_state()
         self.quit()
 
     def get_next_image(self):
@@ -166,8 +383,7 @@ class CinnamonSlideshowApplication(Gio.Application):
         self.load_settings()
         self.connect_signals()
         self.gather_images()
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.connect_folder_monitor()
+        self.connect_folder_monitor()
         self.start_mainloop()
 
     def format_source(self, type, path):
@@ -176,12 +392,20 @@ class CinnamonSlideshowApplication(Gio.Application):
 
     def load_settings(self):
         self.random_order = self.slideshow_settings.get_boolean("random-order")
-        self.collection = self.slideshow_settings.get_string("image-source")
-        self.collection_path = ""
-        self.collection_type = None
-        if self.collection != "" and "://" in self.collection:
-            (self.collection_type, self.collection_path) = self.collection.split("://")
-            self.collection_path = os.path.expanduser(self.collection_path)
+        self.set_collection(self.slideshow_settings.get_string("image-source"))
+
+    def set_collection(self, collection):
+        # image-source holds one 'type://path' source per line.
+        self.collection = collection
+        self.sources = []
+        for source in collection.split("\n"):
+            if "://" in source:
+                (source_type, source_path) = source.split("://", 1)
+                self.sources.append((source_type, os.path.expanduser(source_path)))
+
+        # Directory collections play in name order, xml ones in file order.
+        xml = any(source_type == BACKGROUND_COLLECTION_TYPE_XML for (source_type, source_path) in self.sources)
+        self.playlist = Playlist(sort=not xml)
 
     def connect_signals(self):
         self.slideshow_settings.connect("changed::image-source", self.on_slideshow_source_changed)
@@ -189,94 +413,290 @@ class CinnamonSlideshowApplication(Gio.Application):
         self.background_settings.connect("changed::picture-uri", self.on_picture_uri_changed)
 
     def connect_folder_monitor(self):
-        folder_path = Gio.file_new_for_path(self.collection_path)
-        self.folder_monitor = folder_path.monitor_directory(0, None)
-        self.folder_monitor_id = self.folder_monitor.connect("changed", self.on_monitored_folder_changed)
+        for (source_type, source_path) in self.sources:
+            if source_type in BACKGROUND_COLLECTION_DIRECTORY_TYPES:
+                self.monitor_folder(source_path, source_type == BACKGROUND_COLLECTION_TYPE_RECURSIVE)
+
+    def monitor_folder(self, path, recursive):
+        if path in self.folder_monitors or len(self.folder_monitors) >= MAX_MONITORED_FOLDERS:
+            return
+
+        try:
+            monitor = Gio.file_new_for_path(path).monitor_directory(0, None)
+        except GLib.Error as e:
+            print(f"Could not monitor {path}: {e.message}")
+            return
+
+        monitor_id = monitor.connect("changed", self.on_monitored_folder_changed, recursive)
+        self.folder_monitors[path] = (monitor, monitor_id)
 
     def disconnect_folder_monitor(self):
-        if self.folder_monitor_id > 0:
-            self.folder_monitor.disconnect(self.folder_monitor_id)
-            self.folder_monitor_id = 0
+        for (monitor, monitor_id) in self.folder_monitors.values():
+            monitor.disconnect(monitor_id)
+            monitor.cancel()
+        self.folder_monitors = {}
 
     def gather_images(self):
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            folder_at_path = Gio.file_new_for_path(self.collection_path)
-
-            if folder_at_path.query_exists(None):
-                folder_at_path.enumerate_children_async("standard::name,standard::type,standard::content-type",
-                                                        Gio.FileQueryInfoFlags.NONE,
-                                                        GLib.PRIORITY_LOW,
-                                                        None,
-                                                        self.gather_images_cb,
-                                                        None)
-
-        elif self.collection_type == BACKGROUND_COLLECTION_TYPE_XML:
-            pictures = self.parse_xml_backgrounds_list(self.collection_path)
-            for picture in pictures:
-                filename = picture["filename"]
-                self.add_image_to_playlist(filename)
-
-    def gather_images_cb(self, obj, res, user_data):
-        all_files = []
-        enumerator = obj.enumerate_children_finish(res)
-        def on_next_file_complete(obj, res, user_data=all_files):
-            files = obj.next_files_finish(res)
-            file_list = all_files
-            if len(files) != 0:
-                file_list = file_list.extend(files)
-                enumerator.next_files_async(100, GLib.PRIORITY_LOW, None, on_next_file_complete, None)
-            else:
-                enumerator.close(None)
-                self.ensure_file_is_image(file_list)
+        state = self.load_state()
+        if state is not None:
+            self.playlist.restore(state["images"], state["used"])
+            if self.starting_image is not None and self.is_prescaled_uri(self.starting_image):
+                # the shell was last handed a pre-scaled copy
+                prescaled_path = GLib.filename_from_uri(self.starting_image)[0]
+                self.starting_image = state.get("current")
+                if self.starting_image is not None and not os.path.exists(prescaled_path):
+                    # and it's gone: show the original rather than nothing
+                    self.update_in_progress = True
+                    self.current_image = self.starting_image
+                    self.current_source = self.starting_image
+                    self.background_settings.set_string("picture-uri", self.starting_image)
+                    self.update_in_progress = False
+            self.images_ready = len(self.playlist) > 0
+            self.scanned_mtimes = state["mtimes"]
+            if all(self.get_mtime(path) == mtime for (path, mtime) in state["mtimes"].items()):
+                return
+
+            # Rotate from the snapshot straight away, and catch up with the
+            # changes on disk in the background.
+            self.cancel_scan()
+            self.schedule_rescan()
+            return
+
+        self.scan_collection()
+
+    def schedule_rescan(self):
+        if self.rescan_id == 0 and self.scan is None:
+            self.rescan_id = GLib.timeout_add_seconds(RESCAN_DELAY_SECONDS, self.on_rescan_timeout)
+
+    def on_rescan_timeout(self):
+        self.rescan_id = 0
+        self.scan_collection()
+        return GLib.SOURCE_REMOVE
+
+    def scan_collection(self):
+        self.cancel_scan()
+        self.scan = CollectionScan()
+
+        for (source_type, source_path) in self.sources:
+            if source_type in BACKGROUND_COLLECTION_DIRECTORY_TYPES:
+                self.scan.folders.append((source_path, source_type == BACKGROUND_COLLECTION_TYPE_RECURSIVE))
+                try:
+                    # so that a symlink back to the top isn't followed
+                    info = Gio.file_new_for_path(source_path).query_info("id::file", Gio.FileQueryInfoFlags.NONE, None)
+                    self.scan.seen_folders.add(info.get_attribute_string("id::file"))
+                except GLib.Error:
+                    pass
+            elif source_type == BACKGROUND_COLLECTION_TYPE_XML:
+                self.scan.mtimes[source_path] = self.get_mtime(source_path)
+                for picture in self.parse_xml_backgrounds_list(source_path):
+                    self.scan.images.add(self.add_image_to_playlist(picture["filename"]))
+
+        self.scan_next_folder(self.scan)
+
+    def scan_new_folder(self, path):
+        # A folder appeared in a recursive collection: scan just that one.
+        if self.scan is not None:
+            self.scan.folders.append((path, True))
+            return
+        if self.rescan_id > 0 or self.scanned_mtimes is None:
+            # a full scan is coming anyway
+            return
+
+        self.scan = CollectionScan(partial=True)
+        self.scan.folders.append((path, True))
+        self.scan_next_folder(self.scan)
+
+    def remove_folder(self, path):
+        # A folder we scanned is gone, and its images with it.
+        prefix = Gio.file_new_for_path(path).get_uri() + "/"
+        for uri in self.playlist.uris():
+            if uri.startswith(prefix):
+                self.playlist.remove(uri)
+
+        subfolder_prefix = path + os.sep
+        for folder in list(self.scanned_mtimes):
+            if folder == path or folder.startswith(subfolder_prefix):
+                del self.scanned_mtimes[folder]
+        for folder in list(self.folder_monitors):
+            if folder != path and not folder.startswith(subfolder_prefix):
+                continue
+            (monitor, monitor_id) = self.folder_monitors.pop(folder)
+            monitor.disconnect(monitor_id)
+            monitor.cancel()
+
+        self.save_state()
+
+    def cancel_scan(self):
+        if self.rescan_id > 0:
+            GLib.source_remove(self.rescan_id)
+            self.rescan_id = 0
+
+        if self.scan is not None:
+            self.scan.cancellable.cancel()
+            self.scan = None
+
+    def scan_next_folder(self, scan):
+        # Folders are enumerated one at a time, in batches, and each batch's
+        # images go into the playlist as soon as it arrives.
+        while len(scan.folders) > 0:
+            (path, recursive) = scan.folders.popleft()
+            mtime = self.get_mtime(path)
+            if mtime is None:
+                continue
+
+            scan.mtimes[path] = mtime
+            Gio.file_new_for_path(path).enumerate_children_async(SCAN_ATTRIBUTES,
+                                                                 Gio.FileQueryInfoFlags.NONE,
+                                                                 GLib.PRIORITY_LOW,
+                                                                 scan.cancellable,
+                                                                 self.on_scan_folder_opened,
+                                                                 (scan, path, recursive))
+            return
 
-        enumerator.next_files_async(100, GLib.PRIORITY_LOW, None, on_next_file_complete, all_files)
+        self.finish_scan(scan)
 
-    def ensure_file_is_image(self, file_list):
-        for item in file_list:
-            file_type = item.get_file_type()
-            if file_type is not Gio.FileType.DIRECTORY:
-                file_contents = item.get_content_type()
-                if file_contents.startswith("image"):
-                    self.add_image_to_playlist(self.collection_path + "/" + item.get_name())
+    def on_scan_folder_opened(self, folder, res, data):
+        (scan, path, recursive) = data
+        try:
+            enumerator = folder.enumerate_children_finish(res)
+        except GLib.Error as e:
+            if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                print(f"Could not read {path}: {e.message}")
+                self.scan_next_folder(scan)
+            return
+
+        enumerator.next_files_async(SCAN_BATCH_SIZE, GLib.PRIORITY_LOW, scan.cancellable,
+                                    self.on_scan_files_ready, data)
+
+    def on_scan_files_ready(self, enumerator, res, data):
+        (scan, path, recursive) = data
+        try:
+            files = enumerator.next_files_finish(res)
+        except GLib.Error as e:
+            enumerator.close(None)
+            if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                print(f"Could not read {path}: {e.message}")
+                self.scan_next_folder(scan)
+            return
+
+        if len(files) == 0:
+            enumerator.close(None)
+            self.scan_next_folder(scan)
+            return
+
+        was_ready = self.images_ready
+        for info in files:
+            file_path = os.path.join(path, info.get_name())
+            if info.get_file_type() == Gio.FileType.DIRECTORY:
+                # file ids guard against symlink loops
+                file_id = info.get_attribute_string("id::file")
+                if recursive and not info.get_name().startswith(".") and file_id not in scan.seen_folders:
+                    scan.seen_folders.add(file_id)
+                    scan.folders.append((file_path, True))
+                    self.monitor_folder(file_path, True)
+                continue
+
+            content_type = info.get_content_type()
+            if content_type is not None and content_type.startswith("image"):
+                scan.images.add(self.add_image_to_playlist(file_path))
+
+        if not was_ready and self.images_ready:
+            # start the rotation now rather than on the next poll
+            self.start_mainloop()
+
+        enumerator.next_files_async(SCAN_BATCH_SIZE, GLib.PRIORITY_LOW, scan.cancellable,
+                                    self.on_scan_files_ready, data)
+
+    def finish_scan(self, scan):
+        if scan is not self.scan:
+            return
+
+        self.scan = None
+        if scan.partial:
+            self.scanned_mtimes.update(scan.mtimes)
+        else:
+            # Drop images from the snapshot that are gone from the collection.
+            for uri in self.playlist.uris():
+                if uri not in scan.images:
+                    self.playlist.remove(uri)
+            self.scanned_mtimes = scan.mtimes
+        self.save_state()
+
+    def get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load_state(self):
+        try:
+            with gzip.open(STATE_FILE, "rt", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            print(f"Could not read slideshow state: {e}")
+            return None
+
+        if state.get("version") != STATE_VERSION or state.get("collection") != self.collection:
+            return None
+
+        return state
+
+    def save_state(self):
+        if self.scanned_mtimes is None or not self.images_ready:
+            return
+
+        state = {
+            "version": STATE_VERSION,
+            "collection": self.collection,
+            "mtimes": self.scanned_mtimes,
+            "images": self.playlist.uris(),
+            "used": self.playlist.used_uris(),
+            "current": self.current_source
+        }
+
+        tmp_path = STATE_FILE + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, STATE_FILE)
+        except OSError as e:
+            print(f"Could not save slideshow state: {e}")
 
     def add_image_to_playlist(self, file_path):
         image = Gio.file_new_for_path(file_path)
         image_uri = image.get_uri()
-        self.image_playlist.append(image_uri)
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.image_playlist.sort()
+        self.playlist.add(image_uri)
         self.images_ready = True
+        return image_uri
 
     def on_slideshow_source_changed(self, settings, key):
         if self.update_id > 0:
             GLib.source_remove(self.update_id)
             self.update_id = 0
         self.disconnect_folder_monitor()
-        self.image_playlist = []
-        self.used_image_playlist = []
+        self.cancel_scan()
         self.images_ready = False
-        self.collection = self.slideshow_settings.get_string("image-source")
-        self.collection_path = ""
-        self.collection_type = None
-        if self.collection != "" and "://" in self.collection:
-            (self.collection_type, self.collection_path) = self.collection.split("://")
-            self.collection_path = os.path.expanduser(self.collection_path)
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.connect_folder_monitor()
+        self.scanned_mtimes = None
+        self.reset_prescale()
+        self.set_collection(self.slideshow_settings.get_string("image-source"))
+        self.connect_folder_monitor()
         self.gather_images()
         self.loop_counter = self.slideshow_settings.get_int("delay")
         self.start_mainloop()
 
-    def on_monitored_folder_changed(self, monitor, file1, file2, event_type):
+    def on_monitored_folder_changed(self, monitor, file1, file2, event_type, recursive):
         try:
             if event_type == Gio.FileMonitorEvent.DELETED:
                 file_uri = file1.get_uri()
-                if self.image_playlist.count(file_uri) > 0:
-                    index_to_remove = self.image_playlist.index(file_uri)
-                    del self.image_playlist[index_to_remove]
-                elif self.used_image_playlist.count(file_uri) > 0:
-                    index_to_remove = self.used_image_playlist.index(file_uri)
-                    del self.used_image_playlist[index_to_remove]
+                file_path = file1.get_path()
+                if file_uri in self.playlist:
+                    self.playlist.remove(file_uri)
+                elif recursive and self.scanned_mtimes is not None and file_path in self.scanned_mtimes:
+                    self.remove_folder(file_path)
+                # anything else (editor temp files, thumbnails...) was never part of the collection
 
             if event_type == Gio.FileMonitorEvent.CREATED:
                 file_path = file1.get_path()
@@ -286,11 +706,17 @@ class CinnamonSlideshowApplication(Gio.Application):
                     file_contents = file_info.get_content_type()
                     if file_contents.startswith("image"):
                         self.add_image_to_playlist(file_path)
+                elif recursive and not file1.get_basename().startswith("."):
+                    self.monitor_folder(file_path, True)
+                    self.scan_new_folder(file_path)
         except:
             pass
 
     def on_random_order_changed(self, settings, key):
         self.random_order = self.slideshow_settings.get_boolean("random-order")
+        self.reset_prescale()
+        if self.images_ready:
+            self.prepare_next_image()
 
     def on_picture_uri_changed(self, settings, key):
         if self.update_in_progress:
@@ -321,52 +747,167 @@ class CinnamonSlideshowApplication(Gio.Application):
 
         self.update_in_progress = True
 
-        if len(self.image_playlist) == 0:
-            self.move_used_images_to_original_playlist()
-
         next_image = self.get_next_image_from_list()
         if next_image is not None:
-            self.background_settings.set_string("picture-uri", next_image)
-            self.current_image = next_image
+            picture_uri = self.prescaled.get(next_image)
+            if picture_uri is not None and os.path.exists(GLib.filename_from_uri(picture_uri)[0]):
+                self.cache_hits += 1
+            else:
+                # not ready yet (or the copy was lost): the shell scales it itself
+                self.cache_misses += 1
+                picture_uri = next_image
+
+            self.background_settings.set_string("picture-uri", picture_uri)
+            self.current_image = picture_uri
+            self.current_source = next_image
+            self.save_state()
 
         self.update_in_progress = False
+        self.prepare_next_image()
 
-    def get_next_image_from_list(self):
-        if self.random_order:
-            index = random.randint(0, len(self.image_playlist) - 1)
-            image = self.image_playlist[index]
-        else:
+    def prepare_next_image(self):
+        # Only a guess at what comes next: it is picked (and marked as shown)
+        # when it is time to switch, so toggling random order or removing it
+        # just makes the pre-scaled copy go unused.
+        if not self.random_order:
             self.maybe_skip_past_last_image()
-            index = 0
-            image = self.image_playlist[index]
+        self.next_image = self.playlist.peek(self.random_order)
+        self.prescale_next_image()
+
+    def reset_prescale(self):
+        self.next_image = None
+        self.prescaled = {}
+        self.prescale_generation += 1
+
+    def is_prescaled_uri(self, uri):
+        for folder in (PRESCALE_CACHE_FOLDER, OLD_PRESCALE_CACHE_FOLDER):
+            if uri.startswith(Gio.file_new_for_path(folder).get_uri() + "/"):
+                return True
+        return False
+
+    def get_target_size(self):
+        # The largest monitor, in device pixels, or the whole screen when the
+        # wallpaper is spanned across monitors.
+        display = Gdk.Display.get_default()
+        if display is None or display.get_n_monitors() == 0:
+            return None
+
+        rects = []
+        for i in range(display.get_n_monitors()):
+            monitor = display.get_monitor(i)
+            geometry = monitor.get_geometry()
+            scale = monitor.get_scale_factor()
+            rects.append((geometry.x * scale, geometry.y * scale,
+                          (geometry.x + geometry.width) * scale, (geometry.y + geometry.height) * scale))
+
+        if self.background_settings.get_string("picture-options") == "spanned":
+            return (max(r[2] for r in rects) - min(r[0] for r in rects),
+                    max(r[3] for r in rects) - min(r[1] for r in rects))
+
+        return (max(r[2] - r[0] for r in rects), max(r[3] - r[1] for r in rects))
+
+    def prescale_next_image(self):
+        self.prescale_generation += 1
+        if self.next_image is None or self.next_image in self.prescaled:
+            return
+
+        size = self.get_target_size()
+        try:
+            path = GLib.filename_from_uri(self.next_image)[0]
+        except GLib.Error:
+            path = None
+        if size is None or path is None:
+            return
+
+        # never evict the copy that is on screen
+        keep = set()
+        if self.is_prescaled_uri(self.current_image):
+            keep.add(GLib.filename_from_uri(self.current_image)[0])
 
-        self.move_image_to_used_playlist(index, image)
+        thread = threading.Thread(target=self.prescale_image,
+                                  args=(self.prescale_generation, self.next_image, path, size, keep),
+                                  daemon=True)
+        thread.start()
+
+    def prescale_image(self, generation, uri, path, size, keep):
+        # Runs in a worker thread: only files and pixbufs are touched here,
+        # the result is handed back to the main loop.
+        result = uri
+        try:
+            (info, width, height) = GdkPixbuf.Pixbuf.get_file_info(path)
+            if info is not None and width > 0 and height > 0:
+                # Scale so that the shorter side still covers the longer side
+                # of the screen: every picture-options mode and a rotated
+                # (exif) image then have enough pixels to work with.
+                factor = max(size) / min(width, height)
+                if factor < 1:
+                    result = self.write_prescaled_image(uri, path, width, height, factor, keep)
+        except (GLib.Error, OSError) as e:
+            print(f"Could not pre-scale {path}: {e}")
+
+        GLib.idle_add(self.on_image_prescaled, generation, uri, result)
+
+    def write_prescaled_image(self, uri, path, width, height, factor, keep):
+        stat = os.stat(path)
+        width = math.ceil(width * factor)
+        height = math.ceil(height * factor)
+        key = hashlib.sha1(f"{uri}:{stat.st_mtime_ns}:{stat.st_size}:{width}x{height}".encode()).hexdigest()
+
+        for ext in ("jpg", "png"):
+            cached = os.path.join(PRESCALE_CACHE_FOLDER, f"{key}.{ext}")
+            if os.path.exists(cached):
+                os.utime(cached)
+                return Gio.file_new_for_path(cached).get_uri()
+
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height, False)
+        pixbuf = pixbuf.apply_embedded_orientation()
+        (ext, file_type, keys, values) = ("png", "png", [], []) if pixbuf.get_has_alpha() \
+            else ("jpg", "jpeg", ["quality"], [PRESCALE_JPEG_QUALITY])
+
+        os.makedirs(PRESCALE_CACHE_FOLDER, exist_ok=True)
+        cached = os.path.join(PRESCALE_CACHE_FOLDER, f"{key}.{ext}")
+        tmp_path = os.path.join(PRESCALE_CACHE_FOLDER, f".{key}.tmp")
+        pixbuf.savev(tmp_path, file_type, keys, values)
+        os.replace(tmp_path, cached)
+
+        keep.add(cached)
+        self.trim_prescale_cache(keep)
+        return Gio.file_new_for_path(cached).get_uri()
+
+    def trim_prescale_cache(self, keep):
+        try:
+            with os.scandir(PRESCALE_CACHE_FOLDER) as it:
+                entries = [(entry.stat().st_mtime, entry.path) for entry in it if entry.is_file()]
+        except OSError:
+            return
+
+        entries.sort()
+        for (mtime, path) in entries[:max(0, len(entries) - PRESCALE_CACHE_MAX_FILES)]:
+            if path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def on_image_prescaled(self, generation, uri, picture_uri):
+        if generation == self.prescale_generation:
+            self.prescaled = {uri: picture_uri}
+        return GLib.SOURCE_REMOVE
+
+    def get_next_image_from_list(self):
+        if not self.random_order:
+            self.maybe_skip_past_last_image()
 
-        return image
+        return self.playlist.next(self.random_order)
 
     def maybe_skip_past_last_image(self):
         if self.starting_image is None:
             return
-        # Check if the starting image is in our list (we've rebooted or otherwise a new process)
-        if self.starting_image in self.image_playlist:
-            # Make sure it's *not* the last image in our list. (We want to start over anyhow, if it is)
-            if self.image_playlist[-1] != self.starting_image:
-                # Move all images leading up to, and including this one, to the 'used' bin.
-                while self.image_playlist[0] != self.starting_image:
-                    self.move_image_to_used_playlist(0, self.image_playlist[0])
-                self.move_image_to_used_playlist(0, self.image_playlist[0])
-
-        self.starting_image = None
-
-    def move_image_to_used_playlist(self, index, image):
-        self.image_playlist.pop(index)
-        self.used_image_playlist.append(image)
-
-    def move_used_images_to_original_playlist(self):
-        self.image_playlist = self.used_image_playlist
-        if self.collection_type == BACKGROUND_COLLECTION_TYPE_DIRECTORY:
-            self.image_playlist.sort()
-        self.used_image_playlist = []
+        # If the starting image is in our list (we've rebooted or otherwise a new process),
+        # carry on from the image after it. While the collection is still being scanned
+        # it may just not have turned up yet.
+        if self.playlist.skip_past(self.starting_image) or self.scan is None:
+            self.starting_image = None
 
 
 ########### TAKEN FROM CS_BACKGROUND
@@ -39,6 +39,10 @@ var commandHeader = 'const Clutter = imports.gi.Clutter; ' +
  * even if called through an idle source. */
 const WL_UPDATE_DELAY = 200;
 
+// Identifies this instance's log, so clients paging through it with
+// GetErrorStackSince can tell when Cinnamon was restarted.
+const LOG_ID = GLib.uuid_string_random();
+
 const HISTORY_KEY = 'looking-glass-history';
 
 // these properties throw an error even trying to use typeof on them
@@ -480,6 +484,14 @@ const lgIFace =
                 <arg type="b" direction="out" name="success"/> \
                 <arg type="aa{ss}" direction="out" name="array of dictionary containing keys: timestamp, category, message"/> \
             </method> \
+            <method name="GetErrorStackSince"> \
+                <arg type="s" direction="in" name="log_id"/> \
+                <arg type="u" direction="in" name="cursor"/> \
+                <arg type="b" direction="out" name="success"/> \
+                <arg type="s" direction="out" name="log id, the entries start from the beginning if it differs from the one passed in"/> \
+                <arg type="u" direction="out" name="cursor to pass in to get the entries logged after these"/> \
+                <arg type="aa{ss}" direction="out" name="array of dictionary containing keys: timestamp, category, message"/> \
+            </method> \
             <method name="GetMemoryInfo"> \
                 <arg type="b" direction="out" name="success"/> \
                 <arg type="i" direction="out" name="time since last garbage collect"/> \
@@ -648,6 +660,16 @@ var Melange = class {
         return [true, Main._errorLogStack];
     }
 
+    // DBus function
+    GetErrorStackSince(logId, cursor) {
+        let stack = Main._errorLogStack;
+        if (logId !== LOG_ID || cursor > stack.length) {
+            cursor = 0;
+        }
+
+        return [true, LOG_ID, stack.length, stack.slice(cursor)];
+    }
+
     // DBus function
     GetMemoryInfo() {
         return null;
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from gi.repository import GLib
+
+# Shared among all spice types: identical files (common icons, licenses,
+# theme assets) are stored once.
+store_dir = os.path.join(GLib.get_user_cache_dir(), 'cinnamon', 'spices', 'store')
+
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+def warn(msg):
+    print(msg, file=sys.stderr)
+
+
+class SpiceFileStore:
+    """Content-addressed store of the files of installed spices.
+
+    Objects are kept under objects/<sha256[:2]>/<sha256>-<mode> and are
+    hardlinked into the installed spice folders, so a file that is unchanged
+    across an upgrade is linked back in rather than decompressed and written
+    again. A per-uuid manifest records the zip CRC, size, mode and sha256 of
+    every installed member, which lets an upgrade tell from the new zip's
+    central directory alone which members are unchanged.
+
+    An object whose only remaining link is the store's own is no longer used
+    by any installed spice. The objects of a replaced or removed install are
+    released, and prune() removes those of them that ended up unused.
+    """
+    def __init__(self, spice_type):
+        self.objects_dir = os.path.join(store_dir, 'objects')
+        self.manifests_dir = os.path.join(store_dir, 'manifests', spice_type)
+        self._released = set()
+        self._warned_link = False
+
+    def load_manifest(self, uuid):
+        try:
+            with open(self._manifest_path(uuid), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            warn(f"Could not read file manifest for {uuid}: {e}")
+            return {}
+
+        return manifest if isinstance(manifest, dict) else {}
+
+    def save_manifest(self, uuid, manifest):
+        try:
+            os.makedirs(self.manifests_dir, mode=0o755, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.manifests_dir,
+                                             prefix=".manifest-", delete=False) as f:
+                json.dump(manifest, f)
+            os.replace(f.name, self._manifest_path(uuid))
+        except OSError as e:
+            warn(f"Could not save file manifest for {uuid}: {e}")
+
+    def remove_manifest(self, uuid):
+        self.release(self.load_manifest(uuid))
+        try:
+            os.remove(self._manifest_path(uuid))
+        except FileNotFoundError:
+            pass
+
+    def release(self, manifest):
+        """Marks the objects of a manifest as possibly unused, for prune()."""
+        for entry in manifest.values():
+            try:
+                self._released.add(self._object_path(entry["sha256"], entry["mode"]))
+            except (KeyError, TypeError):
+                pass
+
+    def reuse(self, entry, member, mode, target):
+        """Link the stored copy of an unchanged member to target. Returns
+        False if the member changed or the store no longer has it."""
+        if entry is None:
+            return False
+        if entry.get("crc") != member.CRC or entry.get("size") != member.file_size or entry.get("mode") != mode:
+            return False
+
+        obj = self._object_path(entry["sha256"], mode)
+        try:
+            if os.stat(obj).st_size != member.file_size:
+                return False
+            if self._hash_file(obj) != entry["sha256"]:
+                # An installed copy was edited in place, and with it the
+                # object: drop it so the upgrade brings the real file back.
+                os.remove(obj)
+                return False
+            os.link(obj, target)
+        except OSError:
+            return False
+
+        return True
+
+    def extract(self, _zip, member, mode, target):
+        """Decompress member to target, add it to the store and return its
+        manifest entry."""
+        sha = hashlib.sha256()
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "wb") as out, _zip.open(member) as src:
+            while True:
+                chunk = src.read(COPY_BLOCK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                out.write(chunk)
+
+        entry = {
+            "crc": member.CRC,
+            "size": member.file_size,
+            "mode": mode,
+            "sha256": sha.hexdigest()
+        }
+
+        obj = self._object_path(entry["sha256"], mode)
+        try:
+            os.makedirs(os.path.dirname(obj), mode=0o755, exist_ok=True)
+            os.link(target, obj)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            # e.g. the cache is on another filesystem: the install still
+            # works, later upgrades just can't reuse its files.
+            if not self._warned_link:
+                warn(f"Could not add files to the spice file store: {e}")
+                self._warned_link = True
+
+        return entry
+
+    def prune(self):
+        """Removes the released objects that no installed spice links to."""
+        released = self._released
+        self._released = set()
+
+        for path in released:
+            try:
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+            except OSError:
+                continue
+
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def _hash_file(self, path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(COPY_BLOCK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _manifest_path(self, uuid):
+        return os.path.join(self.manifests_dir, f"{uuid}.json")
+
+    def _object_path(self, sha256, mode):
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}-{mode:o}")
@@ -10,16 +10,23 @@ import zipfile
 import shutil
 import datetime
 import copy
+import hashlib
+import threading
+import time
+from io import BytesIO
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import gi
 gi.require_version('Gio', '2.0')
 from gi.repository import Gio, GLib
 
 from . import logger
+from .filestore import SpiceFileStore
 
 DEBUG = os.getenv("DEBUG") is not None
 
@@ -33,6 +40,12 @@ def warn(msg):
 
 class AbortedError(Exception):
     """Raised by a progress_callback to interrupt an in-flight harvester download."""
+    # the uuids install_many() had already installed when it was interrupted
+    installed = ()
+
+
+class RefreshInProgressError(Exception):
+    """Raised by refresh() when another refresh of the same harvester hasn't finished."""
 
 LANGUAGE_CODE = "C"
 try:
@@ -95,6 +108,33 @@ TIMEOUT_DOWNLOAD_JSON = 15
 TIMEOUT_DOWNLOAD_THUMB = 60
 TIMEOUT_DOWNLOAD_ZIP = 120
 
+THUMB_DOWNLOAD_WORKERS = 10
+ZIP_DOWNLOAD_WORKERS = 4
+
+# Downloaded zips stay in memory up to this size before spilling to disk.
+ZIP_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+ZIP_COPY_BLOCK_SIZE = 64 * 1024
+
+# Installs are extracted into a hidden directory with this prefix inside the
+# install folder, then renamed into place. Leftovers older than
+# STAGING_MAX_AGE seconds are from an interrupted install and are removed.
+STAGING_PREFIX = ".cinnamon-staging-"
+STAGING_MAX_AGE = 60 * 60
+
+# Transient failures (dropped connections, server hiccups) are retried with
+# a 0.5s, 1s, 2s backoff before the error reaches the caller.
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 0.5
+DOWNLOAD_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Files in a spice type's cache folder that aren't thumbnails.
+INDEX_FILE_NAME = "index.json"
+INDEX_VALIDATORS_FILE_NAME = "index-validators.json"
+THUMB_MANIFEST_FILE_NAME = "thumbs.json"
+METADATA_INDEX_FILE_NAME = "metadata-index.json"
+CACHE_RESERVED_FILES = {INDEX_FILE_NAME, INDEX_VALIDATORS_FILE_NAME, THUMB_MANIFEST_FILE_NAME,
+                        METADATA_INDEX_FILE_NAME}
+
 
 def remove_empty_folders(path):
     if not os.path.isdir(path):
@@ -114,6 +154,32 @@ def remove_empty_folders(path):
 
 activity_logger = logger.ActivityLogger()
 
+# One keep-alive connection pool per process, shared by every Harvester
+# (and so by UpdateManager), sized so each thumbnail worker gets its own
+# connection to the spices server.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            retries = Retry(total=DOWNLOAD_RETRIES,
+                            backoff_factor=DOWNLOAD_RETRY_BACKOFF,
+                            status_forcelist=DOWNLOAD_RETRY_STATUSES,
+                            raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=THUMB_DOWNLOAD_WORKERS,
+                                  max_retries=retries)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+
+    return _session
+
 # return how many times 10m goes into the utc timestamp.
 # This gives us a unique value every 10 minutes to allow
 # the server cache to be utilized.
@@ -195,11 +261,30 @@ class Harvester:
         self.updates = []
         self.meta_map = {}
         self.index_cache = {}
+        self.index_sha256 = None
         self._previous_index = {}
 
         self.cache_folder = os.path.join(GLib.get_user_cache_dir(), 'cinnamon', 'spices', self.spice_type)
 
-        self.index_file = os.path.join(self.cache_folder, "index.json")
+        self.index_file = os.path.join(self.cache_folder, INDEX_FILE_NAME)
+        # HTTP validators (ETag, Last-Modified) and the content hash of the
+        # index.json they were served with, for conditional refreshes.
+        self.validators_file = os.path.join(self.cache_folder, INDEX_VALIDATORS_FILE_NAME)
+        # uuid -> {file, size, mtime, sha256, last_edited} for every thumbnail
+        # in the cache folder, so unchanged thumbs are validated with a stat.
+        self.thumb_manifest_file = os.path.join(self.cache_folder, THUMB_MANIFEST_FILE_NAME)
+        self._thumb_manifest = {}
+        self._thumb_manifest_lock = threading.Lock()
+        self._has_thumb_manifest = False
+        # spice folder -> {"stat": [mtime_ns, inode, size], "metadata": {...}}
+        # of its metadata.json, so only new or modified spices are re-parsed.
+        self.metadata_index_file = os.path.join(self.cache_folder, METADATA_INDEX_FILE_NAME)
+        self._metadata_index = None
+        self._metadata_lock = threading.Lock()
+        # held for the whole of a refresh(), so two can't write the cache at once
+        self._refresh_lock = threading.Lock()
+
+        self.file_store = SpiceFileStore(self.spice_type)
 
         # User-writable install destinations from SPICE_MAP. Index 0 is the
         # canonical location for new installs; later entries are alternative
@@ -227,6 +312,7 @@ class Harvester:
             # Corrupt on-disk cache: file has been removed by _load_cache.
             # A subsequent refresh() will repopulate and surface any error.
             pass
+        self._load_thumb_manifest()
         self._load_metadata()
 
     def anything_installed(self):
@@ -242,19 +328,29 @@ class Harvester:
         return False
 
     def refresh(self, full, force=False, progress_callback=None):
+        """Returns True if the index changed, False if it was unchanged and
+        None if nothing is installed and the refresh was skipped."""
         if not force and not self.anything_installed():
             return
 
-        debug(f"Cache stamp: {get_current_timestamp()}")
+        if not self._refresh_lock.acquire(blocking=False):
+            raise RefreshInProgressError(f"a refresh of the {self.spice_type} cache is still running")
 
-        os.makedirs(self.cache_folder, mode=0o755, exist_ok=True)
-        self._update_local_json()
+        try:
+            debug(f"Cache stamp: {get_current_timestamp()}")
 
-        if full:
-            self._update_local_thumbs(progress_callback=progress_callback)
+            os.makedirs(self.cache_folder, mode=0o755, exist_ok=True)
+            changed = self._update_local_json()
 
-        self._load_metadata()
-        self._clean_old_thumbs()
+            if full:
+                self._update_local_thumbs(progress_callback=progress_callback)
+
+            self._load_metadata()
+            self._clean_old_thumbs()
+        finally:
+            self._refresh_lock.release()
+
+        return changed
 
     def reload(self):
         self._load_metadata()
@@ -269,6 +365,15 @@ class Harvester:
     def install(self, uuid, progress_callback=None):
         self._install_by_uuid(uuid, progress_callback=progress_callback)
 
+    def install_many(self, uuids, progress_callback=None):
+        """Download several spices concurrently and install them one at a
+        time, in order, reloading metadata once at the end. Returns a dict of
+        uuid -> exception for those that failed. progress_callback is called
+        with (downloaded_bytes, total_bytes) across all downloads and may
+        raise AbortedError to stop the whole batch, in which case the
+        AbortedError's installed lists the spices installed before that."""
+        return self._install_many_by_uuid(uuids, progress_callback=progress_callback)
+
     def install_from_folder(self, folder, uuid, from_spices=False):
         """Install a spice from a local folder. Used by developer tools that
         bypass the spices server (e.g. cinnamon-install-spice)."""
@@ -351,35 +456,82 @@ class Harvester:
         self.settings.set_strv(self.enabled_key, new_list)
 
     def _update_local_json(self):
+        """Refresh index.json from the server. Returns True if the index
+        changed, False if the server reported (or served) the same content."""
         debug(f"harvester: Downloading new list of available {self.spice_type}s")
         url = SPICE_MAP[self.spice_type]["url"]
 
+        headers = {}
+        validators = self._load_validators()
+        if validators.get("sha256") == self.index_sha256:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last-modified"):
+                headers["If-Modified-Since"] = validators["last-modified"]
+
         try:
-            r = requests.get(url,
-                             timeout=TIMEOUT_DOWNLOAD_JSON,
-                             params={"time": get_current_timestamp()})
+            r = get_session().get(url,
+                                  timeout=TIMEOUT_DOWNLOAD_JSON,
+                                  headers=headers)
             debug(f"Downloading from {r.request.url}")
+            if r.status_code == requests.codes.not_modified:
+                debug(f"harvester: {self.spice_type} index not modified")
+                self._previous_index = self.index_cache
+                return False
             r.raise_for_status()
         except Exception as e:
             warn(f"Could not refresh json data for {self.spice_type}: {e}")
             raise
 
+        content = r.content
+        sha256 = hashlib.sha256(content).hexdigest()
+        new_validators = {
+            "etag": r.headers.get("ETag"),
+            "last-modified": r.headers.get("Last-Modified"),
+            "sha256": sha256
+        }
+
+        if self.has_cache and sha256 == self.index_sha256:
+            debug(f"harvester: {self.spice_type} index unchanged")
+            self._save_validators(new_validators)
+            self._previous_index = self.index_cache
+            return False
+
         # Validate before overwriting the on-disk cache so a malformed
         # response doesn't clobber the previously-good index.
         try:
-            new_cache = json.loads(r.text)
+            new_cache = json.loads(content)
         except ValueError as e:
             warn(f"Server returned malformed JSON for {self.spice_type}: {e}")
             raise
 
-        with open(self.index_file, "w", encoding="utf-8") as f:
-            f.write(r.text)
+        with open(self.index_file, "wb") as f:
+            f.write(content)
+        self._save_validators(new_validators)
 
         # Snapshot the prior index so _download_thumb can tell whether the
         # server-side last_edited moved for each uuid.
         self._previous_index = self.index_cache
         self.index_cache = new_cache
+        self.index_sha256 = sha256
         self.has_cache = True
+        return True
+
+    def _load_validators(self):
+        try:
+            with open(self.validators_file, "r", encoding="utf-8") as f:
+                validators = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return validators if isinstance(validators, dict) else {}
+
+    def _save_validators(self, validators):
+        try:
+            with open(self.validators_file, "w", encoding="utf-8") as f:
+                json.dump(validators, f)
+        except OSError as e:
+            warn(f"Could not save index validators for {self.spice_type}: {e}")
 
     def _update_local_thumbs(self, progress_callback=None):
         # This uses threads for the downloads, but this function blocks until
@@ -391,7 +543,7 @@ class Harvester:
         if total == 0:
             return
 
-        tpe = ThreadPoolExecutor(max_workers=10)
+        tpe = ThreadPoolExecutor(max_workers=THUMB_DOWNLOAD_WORKERS)
         try:
             futures = []
             for uuid, item in items:
@@ -406,85 +558,206 @@ class Harvester:
             # If progress_callback raised AbortedError, drop still-queued thumbs.
             # In-flight ones (up to max_workers) finish on their own.
             tpe.shutdown(wait=False, cancel_futures=True)
+            self._save_thumb_manifest()
 
     def _download_thumb(self, uuid, item):
         paths = SpicePathSet(item, spice_type=self.spice_type)
+
+        if self._thumb_is_current(uuid, item, paths):
+            return
+
+        # Not in the manifest yet (e.g. a cache from before it existed): fall
+        # back to comparing against the previous index and decoding the file.
         prev = self._previous_index.get(uuid)
         server_changed = prev is None or prev.get("last_edited") != item.get("last_edited")
-        needs_download = (not os.path.isfile(paths.thumb_local_path)
-                          or self._is_bad_image(paths.thumb_local_path)
-                          or server_changed)
-        if not needs_download:
-            return
+        if not server_changed:
+            try:
+                with open(paths.thumb_local_path, "rb") as f:
+                    content = f.read()
+            except OSError:
+                content = None
+
+            if content is not None and not self._is_bad_image(BytesIO(content)):
+                self._record_thumb(uuid, item, paths, content)
+                return
 
         debug(f"Downloading thumbnail for {uuid}: {paths.thumb_download_url}")
 
         try:
-            r = requests.get(paths.thumb_download_url,
-                             timeout=TIMEOUT_DOWNLOAD_THUMB,
-                             params={"time": get_current_timestamp()})
+            r = get_session().get(paths.thumb_download_url,
+                                  timeout=TIMEOUT_DOWNLOAD_THUMB,
+                                  params={"time": get_current_timestamp()})
             r.raise_for_status()
         except (requests.RequestException, OSError) as e:
             warn(f"Could not get thumbnail for {uuid}: {e}")
             return
 
+        content = r.content
+        if self._is_bad_image(BytesIO(content)):
+            warn(f"Server returned an invalid thumbnail for {uuid}")
+            return
+
         with open(paths.thumb_local_path, "wb") as f:
-            f.write(r.content)
+            f.write(content)
+        self._record_thumb(uuid, item, paths, content)
+
+    def _thumb_is_current(self, uuid, item, paths):
+        with self._thumb_manifest_lock:
+            entry = self._thumb_manifest.get(uuid)
+
+        if entry is None:
+            return False
+        if entry.get("file") != paths.thumb_basename or entry.get("last_edited") != item.get("last_edited"):
+            return False
+
+        try:
+            st = os.stat(paths.thumb_local_path)
+        except OSError:
+            return False
+
+        return st.st_size == entry.get("size") and st.st_mtime_ns == entry.get("mtime")
+
+    def _record_thumb(self, uuid, item, paths, content):
+        st = os.stat(paths.thumb_local_path)
+        entry = {
+            "file": paths.thumb_basename,
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "last_edited": item.get("last_edited")
+        }
+
+        with self._thumb_manifest_lock:
+            old_entry = self._thumb_manifest.get(uuid)
+            self._thumb_manifest[uuid] = entry
+
+        if old_entry is not None and old_entry.get("file") != paths.thumb_basename:
+            self._remove_thumb_file(old_entry.get("file"))
+
+    def _load_thumb_manifest(self):
+        try:
+            with open(self.thumb_manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            warn(f"Could not read thumbnail manifest for {self.spice_type}: {e}")
+            return
+
+        if isinstance(manifest, dict):
+            self._thumb_manifest = manifest
+            self._has_thumb_manifest = True
+
+    def _save_thumb_manifest(self):
+        with self._thumb_manifest_lock:
+            manifest = dict(self._thumb_manifest)
+
+        try:
+            with open(self.thumb_manifest_file, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            self._has_thumb_manifest = True
+        except OSError as e:
+            warn(f"Could not save thumbnail manifest for {self.spice_type}: {e}")
 
     def _load_metadata(self):
         debug(f"harvester: Loading metadata on installed {self.spice_type}s")
 
-        new_map = {}
+        with self._metadata_lock:
+            if self._metadata_index is None:
+                self._metadata_index = self._load_metadata_index()
+            old_index = self._metadata_index
+            new_index = {}
+            new_map = {}
+            changed = False
 
-        for directory in self.spices_directories:
-            if not os.path.isdir(directory):
-                continue
+            for directory in self.spices_directories:
+                if not os.path.isdir(directory):
+                    continue
 
-            for entry in os.listdir(directory):
-                full_path = os.path.join(directory, entry)
+                for entry in os.listdir(directory):
+                    full_path = os.path.join(directory, entry)
 
-                if self.actions:
-                    if entry == 'sample.nemo_action':
-                        continue
-                    if entry.endswith('.nemo_action'):
-                        sibling_dir = full_path[:-len('.nemo_action')]
-                        if os.path.isdir(sibling_dir):
-                            # Spice-installed action: handled via the sibling dir below.
+                    if self.actions:
+                        if entry == 'sample.nemo_action':
                             continue
-                        uuid = entry[:-len('.nemo_action')]
-                        if uuid in new_map:
+                        if entry.endswith('.nemo_action'):
+                            sibling_dir = full_path[:-len('.nemo_action')]
+                            if os.path.isdir(sibling_dir):
+                                # Spice-installed action: handled via the sibling dir below.
+                                continue
+                            uuid = entry[:-len('.nemo_action')]
+                            if uuid in new_map:
+                                continue
+                            self._load_keyfile_action(full_path, entry, new_map)
                             continue
-                        self._load_keyfile_action(full_path, entry, new_map)
-                        continue
+                        if not os.path.isdir(full_path):
+                            # Other top-level files (helper scripts, etc.)
+                            continue
+
                     if not os.path.isdir(full_path):
-                        # Other top-level files (helper scripts, etc.)
                         continue
 
-                if not os.path.isdir(full_path):
-                    continue
+                    # First-wins: spices_directories iterates user install_folders
+                    # before system paths, so the user-installed copy of a uuid
+                    # masks any system copy and a just-installed upgrade isn't
+                    # shadowed by an orphan in another user-level path.
+                    if entry in new_map or entry.startswith("."):
+                        continue
 
-                # First-wins: spices_directories iterates user install_folders
-                # before system paths, so the user-installed copy of a uuid
-                # masks any system copy and a just-installed upgrade isn't
-                # shadowed by an orphan in another user-level path.
-                if entry in new_map:
-                    continue
+                    meta_path = os.path.join(full_path, "metadata.json")
+                    try:
+                        st = os.stat(meta_path)
+                        key = [st.st_mtime_ns, st.st_ino, st.st_size]
 
-                try:
-                    with open(os.path.join(full_path, "metadata.json"), "r", encoding="utf-8") as f:
-                        metadata = json.load(f)
+                        cached = old_index.get(full_path)
+                        if cached is not None and cached["stat"] == key:
+                            new_index[full_path] = cached
+                        else:
+                            with open(meta_path, "r", encoding="utf-8") as f:
+                                new_index[full_path] = {"stat": key, "metadata": json.load(f)}
+                            changed = True
+
+                        metadata = copy.deepcopy(new_index[full_path]["metadata"])
                         metadata['path'] = full_path
                         metadata['writable'] = os.access(full_path, os.W_OK)
                         new_map[entry] = metadata
-                except FileNotFoundError:
-                    if not self.themes:
-                        warn(f"Skipping {entry}: no metadata.json")
-                except Exception as detail:
-                    warn(detail)
-                    warn(f"Skipping {entry}: there was a problem trying to read metadata.json")
+                    except FileNotFoundError:
+                        if not self.themes:
+                            warn(f"Skipping {entry}: no metadata.json")
+                    except Exception as detail:
+                        warn(detail)
+                        warn(f"Skipping {entry}: there was a problem trying to read metadata.json")
+
+            self._metadata_index = new_index
+            if changed or new_index.keys() != old_index.keys():
+                self._save_metadata_index(new_index)
 
         self.meta_map = new_map
 
+    def _load_metadata_index(self):
+        try:
+            with open(self.metadata_index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            warn(f"Could not read metadata index for {self.spice_type}: {e}")
+            return {}
+
+        return index if isinstance(index, dict) else {}
+
+    def _save_metadata_index(self, index):
+        # Written via a temp file and rename: this can run from job threads
+        # while cinnamon-settings reads the index in another process.
+        try:
+            os.makedirs(self.cache_folder, mode=0o755, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_folder,
+                                             prefix=".metadata-index-", delete=False) as f:
+                json.dump(index, f)
+            os.replace(f.name, self.metadata_index_file)
+        except OSError as e:
+            warn(f"Could not save metadata index for {self.spice_type}: {e}")
+
     def _load_keyfile_action(self, full_path, entry, target_map):
         metadata = {}
         keyfile = GLib.KeyFile.new()
@@ -538,11 +811,14 @@ class Harvester:
         debug(f"harvester: Loading local {self.spice_type} cache")
 
         try:
-            with open(self.index_file, "r", encoding="utf-8") as f:
-                self.index_cache = json.load(f)
-                self.has_cache = True
+            with open(self.index_file, "rb") as f:
+                content = f.read()
+            self.index_cache = json.loads(content)
+            self.index_sha256 = hashlib.sha256(content).hexdigest()
+            self.has_cache = True
         except FileNotFoundError:
             self.index_cache = {}
+            self.index_sha256 = None
             self.has_cache = False
             return
         except ValueError as e:
@@ -551,6 +827,7 @@ class Harvester:
             except:
                 pass
             self.index_cache = {}
+            self.index_sha256 = None
             self.has_cache = False
             raise
 
@@ -589,49 +866,110 @@ class Harvester:
 
         paths = SpicePathSet(item, spice_type=self.spice_type)
 
-        tmp_name = None
         try:
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                tmp_name = tmp.name
-                self._download_zip(paths.zip_download_url, tmp, progress_callback)
-
-            with zipfile.ZipFile(tmp_name) as _zip:
-                with tempfile.TemporaryDirectory() as d:
-                    for member in _zip.infolist():
-                        _zip.extract(member, d)
-                        os.chmod(os.path.join(d, member.filename), member.external_attr >> 16)
-                    self._install_from_folder(os.path.join(d, uuid), d, uuid, from_spices=True)
-                    self.write_to_log(uuid, action)
-
-            if self.actions and action == "install":
-                # Newly installed actions start in the disabled list so the user
-                # has to opt in to running them.
-                disabled = self.settings.get_strv(self.enabled_key)
-                uuid_name = f"{uuid}.nemo_action"
-                if uuid_name not in disabled:
-                    disabled.append(uuid_name)
-                    self.settings.set_strv(self.enabled_key, disabled)
+            with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE) as buf:
+                self._download_zip(paths.zip_download_url, buf, progress_callback)
+                self._install_downloaded_zip(uuid, buf, action)
         except AbortedError:
             raise
         except Exception as e:
             warn(f"couldn't install: {e}")
             raise
         finally:
-            if tmp_name is not None:
+            self.file_store.prune()
+            self._load_metadata()
+
+    def _install_many_by_uuid(self, uuids, progress_callback=None):
+        failures = {}
+        items = {}
+        for uuid in uuids:
+            try:
+                items[uuid] = self.index_cache[uuid]
+            except KeyError as e:
+                warn(f"Can't install {uuid} - it doesn't seem to exist on the server")
+                failures[uuid] = e
+
+        total_size = sum(int(item.get("file_size") or 0) for item in items.values())
+        downloaded = dict.fromkeys(items, 0)
+        progress_lock = threading.Lock()
+
+        def download(uuid):
+            def on_progress(count, block_size, size):
+                with progress_lock:
+                    done = count * block_size
+                    downloaded[uuid] = min(done, size) if size > 0 else done
+                    batch_done = sum(downloaded.values())
+                if progress_callback is not None:
+                    progress_callback(batch_done, max(total_size, batch_done))
+
+            paths = SpicePathSet(items[uuid], spice_type=self.spice_type)
+            buf = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE)
+            try:
+                self._download_zip(paths.zip_download_url, buf, on_progress)
+            except:
+                buf.close()
+                raise
+            return buf
+
+        def close_unused(future):
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+
+        # Downloads run ahead in the pool while the calling thread installs
+        # each finished zip in the order the uuids were given.
+        tpe = ThreadPoolExecutor(max_workers=ZIP_DOWNLOAD_WORKERS)
+        futures = {}
+        taken = set()
+        installed = []
+        try:
+            futures = {uuid: tpe.submit(download, uuid) for uuid in items}
+            for uuid, future in futures.items():
+                action = "upgrade" if uuid in self.meta_map else "install"
+                taken.add(uuid)
                 try:
-                    os.remove(tmp_name)
-                except FileNotFoundError:
-                    pass
+                    with future.result() as buf:
+                        self._install_downloaded_zip(uuid, buf, action)
+                    installed.append(uuid)
+                except AbortedError as e:
+                    e.installed = installed
+                    raise
+                except Exception as e:
+                    warn(f"couldn't install {uuid}: {e}")
+                    failures[uuid] = e
+        finally:
+            tpe.shutdown(wait=False, cancel_futures=True)
+            # Downloads that finished (or will) but were never installed
+            for uuid, future in futures.items():
+                if uuid not in taken:
+                    future.add_done_callback(close_unused)
+            self.file_store.prune()
             self._load_metadata()
 
+        return failures
+
+    def _install_downloaded_zip(self, uuid, buf, action):
+        buf.seek(0)
+        with zipfile.ZipFile(buf) as _zip:
+            self._install_from_zip(_zip, uuid)
+        self.write_to_log(uuid, action)
+
+        if self.actions and action == "install":
+            # Newly installed actions start in the disabled list so the user
+            # has to opt in to running them.
+            disabled = self.settings.get_strv(self.enabled_key)
+            uuid_name = f"{uuid}.nemo_action"
+            if uuid_name not in disabled:
+                disabled.append(uuid_name)
+                self.settings.set_strv(self.enabled_key, disabled)
+
     def _download_zip(self, url, out_file, progress_callback):
         block_size = 16 * 1024
 
         try:
-            r = requests.get(url,
-                             timeout=TIMEOUT_DOWNLOAD_ZIP,
-                             params={"time": get_current_timestamp()},
-                             stream=True)
+            r = get_session().get(url,
+                                  timeout=TIMEOUT_DOWNLOAD_ZIP,
+                                  params={"time": get_current_timestamp()},
+                                  stream=True)
             r.raise_for_status()
         except Exception as e:
             warn(f"Could not start zip download: {e}")
@@ -670,6 +1008,8 @@ class Harvester:
                         shutil.rmtree(cfg_path)
 
             self._remove_spice_from_all_directories(uuid)
+            self.file_store.remove_manifest(uuid)
+            self.file_store.prune()
 
             if self.actions:
                 disabled_list = self.settings.get_strv(self.enabled_key)
@@ -686,21 +1026,7 @@ class Harvester:
             self._load_metadata()
 
     def _install_from_folder(self, folder, base_folder, uuid, from_spices=False):
-        contents = os.listdir(folder)
-
-        if not self.themes:
-            # Install spice localization files, if any
-            if 'po' in contents:
-                po_dir = os.path.join(folder, 'po')
-                for file in os.listdir(po_dir):
-                    if file.endswith('.po'):
-                        lang = file.split(".")[0]
-                        locale_dir = os.path.join(locale_inst, lang, 'LC_MESSAGES')
-                        os.makedirs(locale_dir, mode=0o755, exist_ok=True)
-                        subprocess.run(['/usr/bin/msgfmt', '-c',
-                                       os.path.join(po_dir, file), '-o',
-                                       os.path.join(locale_dir, f'{uuid}.mo')],
-                                       check=True)
+        self._install_translations(folder, uuid)
 
         os.makedirs(self.install_folder, mode=0o755, exist_ok=True)
 
@@ -715,7 +1041,136 @@ class Harvester:
         else:
             shutil.copytree(base_folder, self.install_folder, dirs_exist_ok=True)
 
-        meta_path = os.path.join(dest, 'metadata.json')
+        self._write_install_metadata(dest, uuid, from_spices)
+
+    def _install_from_zip(self, _zip, uuid):
+        # Extracts straight into a staging directory beside the destination
+        # and renames it into place, so an interrupted install never leaves
+        # a partially copied spice behind.
+        prefix = f"{uuid}/"
+        members = []
+        top_level = []
+        for member in _zip.infolist():
+            parts = Path(member.filename).parts
+            if member.filename.startswith("/") or ".." in parts:
+                raise ValueError(f"Refusing to install {uuid}: unsafe path '{member.filename}' in zip")
+            if member.filename.startswith(prefix):
+                members.append(member)
+            elif self.actions and len(parts) == 1 and not member.is_dir():
+                # e.g. the <uuid>.nemo_action file next to the action's folder
+                top_level.append(member)
+
+        if not members:
+            raise ValueError(f"Refusing to install {uuid}: no {prefix} folder in zip")
+        if not self.themes and f"{prefix}metadata.json" not in _zip.namelist():
+            raise ValueError(f"Refusing to install {uuid}: no metadata.json in zip")
+
+        os.makedirs(self.install_folder, mode=0o755, exist_ok=True)
+        self._remove_stale_staging()
+
+        # Members whose CRC, size and mode match the previously installed
+        # copy are linked from the file store instead of being decompressed.
+        old_manifest = self.file_store.load_manifest(uuid)
+        manifest = {}
+        reused = 0
+
+        staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.install_folder)
+        try:
+            for member in members + top_level:
+                target = os.path.join(staging, member.filename)
+                if member.is_dir() or member.filename == f"{prefix}metadata.json":
+                    # metadata.json is rewritten on install, so isn't shared.
+                    self._extract_member(_zip, member, target)
+                    continue
+
+                os.makedirs(os.path.dirname(target), mode=0o755, exist_ok=True)
+                mode = (member.external_attr >> 16) & 0o777 or 0o644
+                entry = old_manifest.get(member.filename)
+                if self.file_store.reuse(entry, member, mode, target):
+                    reused += 1
+                else:
+                    entry = self.file_store.extract(_zip, member, mode, target)
+                manifest[member.filename] = entry
+
+            debug(f"Reused {reused} of {len(manifest)} files for {uuid} from the file store")
+
+            staged_folder = os.path.join(staging, uuid)
+            os.chmod(staged_folder, 0o755)
+            self._install_translations(staged_folder, uuid)
+            self._write_install_metadata(staged_folder, uuid, from_spices=True)
+
+            self._remove_spice_from_all_directories(uuid, keep_folder=self.install_folder)
+
+            dest = os.path.join(self.install_folder, uuid)
+            if os.path.lexists(dest):
+                os.rename(dest, os.path.join(staging, f"{uuid}.old"))
+            os.rename(staged_folder, dest)
+
+            if self.actions:
+                action_file = f"{uuid}.nemo_action"
+                if action_file not in (member.filename for member in top_level):
+                    try:
+                        os.remove(os.path.join(self.install_folder, action_file))
+                    except FileNotFoundError:
+                        pass
+                for member in top_level:
+                    os.replace(os.path.join(staging, member.filename),
+                               os.path.join(self.install_folder, member.filename))
+
+            self.file_store.save_manifest(uuid, manifest)
+            # the replaced copy's files are unlinked with the staging folder
+            self.file_store.release(old_manifest)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _extract_member(self, _zip, member, target):
+        if member.is_dir():
+            os.makedirs(target, mode=0o755, exist_ok=True)
+            return
+
+        os.makedirs(os.path.dirname(target), mode=0o755, exist_ok=True)
+
+        # Create the file with its archived permissions rather than
+        # chmod'ing it after the fact.
+        mode = (member.external_attr >> 16) & 0o777 or 0o644
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "wb") as out, _zip.open(member) as src:
+            shutil.copyfileobj(src, out, ZIP_COPY_BLOCK_SIZE)
+
+    def _remove_stale_staging(self):
+        now = time.time()
+        for entry in os.listdir(self.install_folder):
+            if not entry.startswith(STAGING_PREFIX):
+                continue
+            path = os.path.join(self.install_folder, entry)
+            try:
+                if now - os.stat(path).st_mtime > STAGING_MAX_AGE:
+                    debug(f"Removing interrupted install: {path}")
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _install_translations(self, folder, uuid):
+        if self.themes:
+            return
+
+        # Install spice localization files, if any
+        po_dir = os.path.join(folder, 'po')
+        if not os.path.isdir(po_dir):
+            return
+
+        for file in os.listdir(po_dir):
+            if file.endswith('.po'):
+                lang = file.split(".")[0]
+                locale_dir = os.path.join(locale_inst, lang, 'LC_MESSAGES')
+                os.makedirs(locale_dir, mode=0o755, exist_ok=True)
+                subprocess.run(['/usr/bin/msgfmt', '-c',
+                               os.path.join(po_dir, file), '-o',
+                               os.path.join(locale_dir, f'{uuid}.mo')],
+                               check=True)
+
+    def _write_install_metadata(self, folder, uuid, from_spices):
+        meta_path = os.path.join(folder, 'metadata.json')
 
         if self.themes and not os.path.exists(meta_path):
             md = {}
@@ -728,13 +1183,19 @@ class Harvester:
         else:
             md['last-edited'] = int(datetime.datetime.utcnow().timestamp())
 
-        with open(meta_path, "w+", encoding='utf-8') as f:
+        # Replace rather than rewrite in place: installed files may be
+        # hardlinks into the spice file store.
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
             json.dump(md, f, indent=4)
+        os.replace(tmp_path, meta_path)
 
-    def _remove_spice_from_all_directories(self, uuid):
+    def _remove_spice_from_all_directories(self, uuid, keep_folder=None):
         # Iterates user-writable install_folders only — system spices are
         # package-managed and not ours to delete from /usr/share/.
         for directory in self.install_folders:
+            if directory == keep_folder:
+                continue
             dest = os.path.join(directory, uuid)
             if os.path.isdir(dest):
                 shutil.rmtree(dest, ignore_errors=True)
@@ -767,6 +1228,7 @@ class Harvester:
         activity_logger.log(f"{log_timestamp} {self.spice_type} {action} {uuid} {old_version} {new_version}")
 
     def _is_bad_image(self, path):
+        # path may also be a file object holding freshly downloaded bytes.
         try:
             Image.open(path)
         except IOError:
@@ -775,20 +1237,38 @@ class Harvester:
 
     def _clean_old_thumbs(self):
         # Cleanup obsolete thumbs
-        flist = os.listdir(self.cache_folder)
+        if not self._has_thumb_manifest:
+            self._clean_untracked_thumbs()
+            return
 
+        with self._thumb_manifest_lock:
+            stale = [uuid for uuid in self._thumb_manifest if uuid not in self.index_cache]
+            stale_entries = [self._thumb_manifest.pop(uuid) for uuid in stale]
+            tracked = {entry.get("file") for entry in self._thumb_manifest.values()}
+
+        # Only what the manifest no longer tracks goes, without listing the folder.
+        for entry in stale_entries:
+            if entry.get("file") not in tracked:
+                self._remove_thumb_file(entry.get("file"))
+        if stale_entries:
+            self._save_thumb_manifest()
+
+    def _clean_untracked_thumbs(self):
+        # Without a manifest, anything that isn't a current thumb goes.
+        keep = set()
         for item in self.index_cache.values():
-            paths = SpicePathSet(item, spice_type=self.spice_type)
-            try:
-                flist.remove(paths.thumb_basename)
-            except ValueError:
-                pass
+            keep.add(SpicePathSet(item, spice_type=self.spice_type).thumb_basename)
 
-        for f in flist:
-            if f == "index.json":
+        for f in os.listdir(self.cache_folder):
+            if f in keep or f in CACHE_RESERVED_FILES:
                 continue
-            try:
-                debug(f"removing old thumb: {f}")
-                os.remove(os.path.join(self.cache_folder, f))
-            except:
-                pass
+            self._remove_thumb_file(f)
+
+    def _remove_thumb_file(self, basename):
+        if not basename or basename in CACHE_RESERVED_FILES:
+            return
+        try:
+            debug(f"removing old thumb: {basename}")
+            os.remove(os.path.join(self.cache_folder, basename))
+        except:
+            pass
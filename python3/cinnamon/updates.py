@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 import gettext
+import threading
+import time
 import gi
 
 from . import harvester
@@ -18,6 +20,42 @@ SPICE_TYPE_ACTION = "action"
 SPICE_TYPES = [SPICE_TYPE_APPLET, SPICE_TYPE_DESKLET, SPICE_TYPE_THEME,
                SPICE_TYPE_EXTENSION, SPICE_TYPE_ACTION]
 
+# Overall deadline, in seconds, for a parallel refresh_all_caches().
+REFRESH_TIMEOUT = 60
+
+REFRESH_CHANGED = "changed"
+REFRESH_UNCHANGED = "unchanged"
+REFRESH_SKIPPED = "skipped"
+REFRESH_FAILED = "failed"
+REFRESH_TIMED_OUT = "timed-out"
+REFRESH_BUSY = "busy"
+
+
+class RefreshResult:
+    def __init__(self, spice_type):
+        self.spice_type = spice_type
+        self.status = REFRESH_TIMED_OUT
+        self.error = None
+        self.elapsed = 0.0
+
+
+class RefreshStats:
+    def __init__(self):
+        self.results = {}
+        self.elapsed = 0.0
+
+    def with_status(self, status):
+        return [result.spice_type for result in self.results.values() if result.status == status]
+
+    @property
+    def failed(self):
+        return self.with_status(REFRESH_FAILED) + self.with_status(REFRESH_TIMED_OUT) + self.with_status(REFRESH_BUSY)
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
 class UpdateManager:
     def __init__(self):
         self.harvesters = {}
@@ -30,9 +68,77 @@ class UpdateManager:
             updates += self.get_updates_of_type(spice_type)
         return updates
 
-    def refresh_all_caches(self, full=False):
-        for spice_type in SPICE_TYPES:
-            self.refresh_cache_for_type(spice_type, full)
+    def refresh_all_caches(self, full=False, parallel=False, timeout=REFRESH_TIMEOUT):
+        """Refresh the cache of every spice type and return a RefreshStats.
+
+        With parallel=True all types are refreshed at once, a failure in one
+        type is recorded in its RefreshResult without stopping the others,
+        and any still running after timeout seconds are reported as timed
+        out. Those are abandoned: they run in daemon threads, so they don't
+        keep the process from exiting, and a type whose refresh is still
+        running is reported busy by later calls rather than refreshed twice.
+        """
+        stats = RefreshStats()
+        start = time.monotonic()
+
+        if parallel:
+            finished = {}
+
+            def run(spice_type):
+                finished[spice_type] = self._timed_refresh(spice_type, full)
+
+            threads = []
+            for spice_type in SPICE_TYPES:
+                thread = threading.Thread(target=run, args=(spice_type,), daemon=True,
+                                          name=f"refresh-{spice_type}")
+                thread.start()
+                threads.append(thread)
+
+            deadline = start + timeout
+            for thread in threads:
+                thread.join(max(0, deadline - time.monotonic()))
+
+            for spice_type in SPICE_TYPES:
+                result = finished.get(spice_type)
+                if result is None:
+                    result = RefreshResult(spice_type)
+                    result.error = TimeoutError(f"still running after {timeout}s")
+                stats.results[spice_type] = result
+        else:
+            # Sequential refreshes keep their historical behaviour of
+            # stopping at, and raising, the first error.
+            for spice_type in SPICE_TYPES:
+                result = self._timed_refresh(spice_type, full)
+                if result.error is not None:
+                    raise result.error
+                stats.results[spice_type] = result
+
+        stats.elapsed = time.monotonic() - start
+
+        for spice_type in stats.failed:
+            result = stats.results[spice_type]
+            harvester.warn(f"Refreshing {spice_type} cache {result.status}: {result.error}")
+        harvester.debug(f"Refreshed all caches in {stats.elapsed:.2f}s")
+
+        return stats
+
+    def _timed_refresh(self, spice_type, full):
+        result = RefreshResult(spice_type)
+        start = time.monotonic()
+        try:
+            changed = self.refresh_cache_for_type(spice_type, full)
+            if changed is None:
+                result.status = REFRESH_SKIPPED
+            else:
+                result.status = REFRESH_CHANGED if changed else REFRESH_UNCHANGED
+        except harvester.RefreshInProgressError as e:
+            result.status = REFRESH_BUSY
+            result.error = e
+        except Exception as e:
+            result.status = REFRESH_FAILED
+            result.error = e
+        result.elapsed = time.monotonic() - start
+        return result
 
     def refresh_cache_for_type(self, spice_type, full=False):
         _harvester = self.harvesters[spice_type]
@@ -10,8 +10,81 @@ gi.require_version('Gdk', '3.0')
 from gi.repository import Gdk, Gtk, GObject, GLib, Pango
 
 import time
+import csv
+import json
+from collections import deque
 from datetime import timedelta
 
+# How often the aggregated stap output is applied to the window
+FLUSH_INTERVAL_MS = 500
+
+# How many of the most recent samples are kept for exporting
+SAMPLES_MAX = 200000
+
+class Aggregator:
+    """
+    Collects the stap output on the reader thread: GObject instance deltas are
+    summed per type name, other lines are queued for the output view. The UI
+    takes everything that changed since its last look with take_batch().
+
+    Every GObject delta is also recorded as a sample (elapsed time, name,
+    delta, instance count and rate) for exporting. Only the last SAMPLES_MAX
+    are kept, older ones are dropped as new ones come in.
+    """
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            # name -> [instance count, time of the previous sample]
+            self.types = {}
+            self.changed = {}
+            self.lines = []
+            self.samples = deque(maxlen=SAMPLES_MAX)
+
+    def add_line(self, line):
+        if line[:7] == "GObject":
+            try:
+                [prefix, name, delta] = line.split(":::")
+                delta = int(delta)
+            except ValueError:
+                return
+            self.add_delta(name, delta)
+        else:
+            with self.lock:
+                self.lines.append(line)
+
+    def add_delta(self, name, delta):
+        now = time.time()
+        with self.lock:
+            entry = self.types.get(name)
+            if entry is None:
+                entry = [0, self.start_time]
+                self.types[name] = entry
+
+            entry[0] += delta
+            # deltas are per stap reporting interval, turn them into a rate
+            interval = now - entry[1]
+            rate = delta / interval if interval > 0 else 0.0
+            entry[1] = now
+
+            self.changed[name] = (entry[0], rate)
+            self.samples.append((round(now - self.start_time, 3), name, delta, entry[0], rate))
+
+    def take_batch(self):
+        with self.lock:
+            changed = self.changed
+            lines = self.lines
+            self.changed = {}
+            self.lines = []
+        return changed, lines
+
+    def get_samples(self):
+        with self.lock:
+            return list(self.samples)
+
 class Main:
     def __init__(self):
         if len(sys.argv) > 1 and sys.argv[1] == "--help":
@@ -41,7 +114,10 @@ class Main:
         self.builder.connect_signals(self)
 
         self.treeview = Gtk.TreeView()
-        self.model = Gtk.ListStore(str, int, int)
+        self.model = Gtk.ListStore(str, int, float)
+        # type name -> model iter (ListStore iters stay valid)
+        self.rows = {}
+        self.aggregator = Aggregator()
 
         color = Gdk.RGBA()
         Gdk.RGBA.parse(color, "black")
@@ -66,7 +142,8 @@ class Main:
         self.treeview.append_column(column)
 
         cell = Gtk.CellRendererText()
-        column = Gtk.TreeViewColumn("Rate", cell, text=2)
+        column = Gtk.TreeViewColumn("Rate (/s)", cell)
+        column.set_cell_data_func(cell, self.rate_cell_data_func)
         column.set_sort_column_id(2)
 
         self.treeview.append_column(column)
@@ -82,6 +159,10 @@ class Main:
         self.window.show_all()
 
         GObject.timeout_add_seconds(1, self.update_timer_label)
+        GLib.timeout_add(FLUSH_INTERVAL_MS, self.flush)
+
+    def rate_cell_data_func(self, column, cell, model, row_iter, data=None):
+        cell.set_property("text", "%.2f" % model.get_value(row_iter, 2))
 
     # def on_button_press_event(self, widget, event):
     #     if event.button == 1:
@@ -100,6 +181,7 @@ class Main:
 
     def reset_timer(self):
         self.start_time = time.time()
+        self.aggregator.reset()
 
     def update_timer_label(self):
         now = time.time()
@@ -120,7 +202,7 @@ class Main:
 
     def stdin_feed_thread(self):
         for line in sys.stdin:
-            GObject.idle_add(self.handle_line, line)
+            self.aggregator.add_line(line)
             self.cancel_lock.acquire()
             cancelled = self.cancelled
             self.cancel_lock.release()
@@ -129,37 +211,20 @@ class Main:
 
         _thread.exit()
 
-    def handle_line(self, line):
-        if line[:7] == "GObject":
-            [prefix, name, delta] = line.split(":::")
+    def flush(self):
+        changed, lines = self.aggregator.take_batch()
 
-            [new, target_iter] = self.lookup_name_or_new(name)
-
-            if new:
-                self.model.set_value(target_iter, 0, name)
-                self.model.set_value(target_iter, 1, int(delta))
-                self.model.set_value(target_iter, 2, int(delta))
+        for name, (count, rate) in changed.items():
+            row_iter = self.rows.get(name)
+            if row_iter is None:
+                self.rows[name] = self.model.insert_with_valuesv(-1, [0, 1, 2], [name, count, rate])
             else:
-                current_val = self.model.get_value(target_iter, 1)
-                current_val = int(current_val) + int(delta)
-                self.model.set_value(target_iter, 1, current_val)
-                self.model.set_value(target_iter, 2, int(delta))
-
-        else:
-            self.write_line_to_buffer(line)
+                self.model.set(row_iter, [1, 2], [count, rate])
 
-    def lookup_name_or_new(self, name):
-        row_iter = self.model.get_iter_first()
-
-        while row_iter is not None:
-            existing_name = self.model.get_value(row_iter, 0)
-            if name == existing_name:
-                return [False, row_iter]
-
-            row_iter = self.model.iter_next(row_iter)
-
-        return [True, self.model.insert_before(None, None)]
+        if len(lines) > 0:
+            self.write_line_to_buffer("".join(lines))
 
+        return True
 
     # def selection_changed(self):
     #     model, treeiter = self.treeview.get_selection().get_selected()
@@ -186,8 +251,49 @@ class Main:
 
     def on_reset_clicked(self, button):
         self.model.clear()
+        self.rows = {}
         self.reset_timer()
 
+    def on_export_clicked(self, button):
+        dialog = Gtk.FileChooserDialog(title="Export samples",
+                                       parent=self.window,
+                                       action=Gtk.FileChooserAction.SAVE)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                           Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("stap-samples.csv")
+
+        for (name, pattern) in (("CSV", "*.csv"), ("JSON", "*.json")):
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            dialog.add_filter(file_filter)
+
+        response = dialog.run()
+        filename = dialog.get_filename()
+        dialog.destroy()
+
+        if response != Gtk.ResponseType.OK or filename is None:
+            return
+
+        try:
+            self.export_samples(filename)
+        except OSError as e:
+            self.inform_error("Could not export samples", GLib.markup_escape_text(str(e)))
+
+    def export_samples(self, filename):
+        # The format follows the extension, csv unless it's .json
+        fields = ("elapsed", "name", "delta", "count", "rate")
+        samples = self.aggregator.get_samples()
+
+        with open(filename, "w", newline="") as f:
+            if filename.endswith(".json"):
+                json.dump([dict(zip(fields, sample)) for sample in samples], f, indent=2)
+            else:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                writer.writerows(samples)
+
     def write_to_buffer(self, fd, condition):
         if condition == GLib.IO_IN:
             char = fd.readline()